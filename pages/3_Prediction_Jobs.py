@@ -0,0 +1,102 @@
+import streamlit as st
+import pandas as pd
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from columnar import is_parquet
+from jobs import JobQueue, JobWorker
+
+st.set_page_config(
+    page_title="Prediction Jobs",
+    layout="centered",
+)
+
+# Seconds between status refreshes of the selected job
+POLL_INTERVAL = 2
+# Latest predicted rows shown on each refresh
+TAIL_ROWS = 100
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+# One background worker per server process, shared by every session; jobs keep running when a
+# browser disconnects. It uses all cores, so it shares its OCR pool with the CSV page's default
+# setting. Set JOBS_EXTERNAL_WORKER=1 when `python jobs.py worker` runs them instead.
+@st.cache_resource(show_spinner=False)
+def start_job_worker():
+    if os.environ.get('JOBS_EXTERNAL_WORKER'):
+        return None
+    worker = JobWorker(get_job_queue())
+    worker.start()
+    return worker
+
+# A job's input never changes, so its index column is read once instead of on every refresh
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_job_index(job_id):
+    return get_job_queue().input_index(job_id)
+
+@st.fragment(run_every=POLL_INTERVAL)
+def show_job(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        st.warning("Job not found.")
+        return
+
+    st.progress(job['done_rows'] / job['total_rows'] if job['total_rows'] else 1.0)
+    st.write(f"**{job['status'].capitalize()}**: {job['done_rows']} of {job['total_rows']} rows predicted")
+    if job['error']:
+        st.error(job['error'])
+
+    index = load_job_index(job_id)
+    st.dataframe(queue.results(job_id, last=TAIL_ROWS, index=index))
+
+    # Finished rows can be downloaded at any time, not only once the job is done. The full CSV is
+    # only built when asked for, not on every refresh
+    if st.button("Prepare download of predicted rows", key=f"prepare_{job_id}"):
+        st.session_state[f"download_{job_id}"] = (
+            job['done_rows'], queue.results(job_id, index=index).to_csv(index=False).encode('utf-8'))
+    prepared = st.session_state.get(f"download_{job_id}")
+    if prepared is not None:
+        done_rows, data = prepared
+        st.download_button(
+            label=f"Download {done_rows} predicted rows",
+            data=data,
+            file_name=f"predictions_{job_id[:8]}.csv",
+            mime='text/csv',
+            key=f"download_{job_id}_{done_rows}",
+        )
+    if job['status'] in ('queued', 'running') and st.button("Cancel job", key=f"cancel_{job_id}"):
+        queue.cancel(job_id)
+
+def main():
+    st.title("Prediction Jobs")
+    queue = get_job_queue()
+    start_job_worker()
+
+    # Queue an uploaded CSV; it is predicted in the background, not in this script run
+    uploaded_file = st.file_uploader("Upload a CSV or Parquet file to predict", type=["csv", "parquet"])
+    if uploaded_file is not None and st.button("Submit job"):
+        input_df = pd.read_parquet(uploaded_file) if is_parquet(uploaded_file.name) else pd.read_csv(uploaded_file)
+        st.session_state['job_id'] = queue.submit(input_df, uploaded_file.name)
+        st.success(f"Queued {len(input_df)} rows.")
+
+    # Every job is listed, so a job can be found again after the session reconnects
+    jobs = queue.list()
+    if not jobs:
+        st.write("No jobs yet.")
+        return
+    st.dataframe(pd.DataFrame(jobs)[['name', 'status', 'done_rows', 'total_rows', 'id']])
+
+    job_ids = [job['id'] for job in jobs]
+    selected = st.session_state.get('job_id')
+    job_id = st.selectbox(
+        "Job", job_ids, index=job_ids.index(selected) if selected in job_ids else 0,
+        format_func=lambda job_id: next(f"{job['name']} ({job['status']}, {job_id[:8]})"
+                                        for job in jobs if job['id'] == job_id))
+    show_job(job_id)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from units import unit_matcher
+
+
+def predict_frame(df, text_column='text', entity_column='entity_name', matcher=unit_matcher):
+    """Answer every row of `df` from its OCR text with vectorized string operations.
+
+    Rows are grouped by entity and each group is searched with one
+    `str.extract` call using that entity's pattern, which only matches units
+    allowed for the entity. As in `get_value_for_entity`, the first allowed
+    match in each text wins. Returns a `prediction` Series aligned with
+    `df.index`, holding None where nothing matched.
+    """
+    texts = df[text_column].reset_index(drop=True)
+    entity_names = df[entity_column].reset_index(drop=True)
+    prediction = pd.Series([None] * len(df), dtype=object)
+
+    for entity_name, positions in entity_names.groupby(entity_names).groups.items():
+        pattern = matcher.entity_patterns.get(entity_name)
+        if pattern is None:
+            continue
+        matches = texts.loc[positions].str.extract(pattern).dropna()
+        if matches.empty:
+            continue
+        units = matches[1].str.replace(r'\s+', '', regex=True).str.casefold().map(matcher.canonical)
+        # The matched digits, as `units.format_match` writes them, rather than a float's repr
+        numbers = matches[0].str.replace(r'\.$', '', regex=True)
+        prediction.loc[matches.index] = (numbers + ' ' + units).to_numpy()
+
+    prediction.index = df.index
+    prediction.name = 'prediction'
+    return prediction
@@ -0,0 +1,556 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import threading
+import functools
+import subprocess
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from batch_extract import predict_frame
+from ocr import decode_image, get_reader_service
+from ocr_cache import content_hash, get_ocr_cache
+from pipeline import MissingImage, fetch_image, fetch_image_bytes
+from predict import extract_values_with_units, get_value_for_entity
+from units import unit_mapping, entity_unit_map, unit_matcher, format_match, to_base
+from preprocess import Preprocessor
+from ranking import ENTITY_KEYWORDS, PLAUSIBLE_RANGES, CandidateRanker
+from sanity import sanity_check
+from utils import download_images, parse_string
+
+# The alternation pattern extract_values_with_units used before the compiled matcher, kept as the baseline
+LEGACY_PATTERN = r'(\d+\.?\d*)\s*(centimetre|centimeters?|cm|foot|feet|ft|inch|inches?|in|millivolt|mv|millilitre|ml|milligram|mg|millimeter|millimeters?|mm|metre|meters?|m|yard|yards?|yd|gallon|gal|gallons?|gram?|g|grams?|gms?|gramme|kiloleter?|kl|kilowatt|kw|kilogram|kg|kgs?|kilos?|kilograms?|kilo|microgram|µg|ounce|ounces?|oz|pound|pounds?|lbs?|lb|ton|tons?|tonnes?|t|kilovolt|kv|volt|volts?|v|watt|watts?|w|centilitre|cl|centilitres?|cubic\s*foot|ft³|cubic\s*feet?|cubic\s*inch|in³|cup|cups?|c|decilitre|dl|decilitres?|fluid\s*ounce|fl\s*oz|fluid\s*ounces?|imperial\s*gallon|imp\s*gal|litre|litres?|l|liters?|microlitre|µl|pint|pints?|pt|quart|quarts?|qt)'
+
+FILLER_WORDS = ['premium', 'quality', 'stainless', 'steel', 'pack', 'of', 'new', 'size', 'made', 'in', 'india',
+                'capacity', 'weight', 'net', 'width', 'height', 'model', 'x', 'cm', 'wide', 'color', 'black']
+
+
+def legacy_extract_values_with_units(text):
+    matches = re.findall(LEGACY_PATTERN, text, re.IGNORECASE)
+    extracted_info = []
+    for value, unit in matches:
+        full_unit = unit_mapping.get(unit.lower(), unit)
+        extracted_info.append(f"{value} {full_unit}")
+    return extracted_info
+
+
+def legacy_get_value_for_entity(entity_name, text):
+    if entity_name not in entity_unit_map:
+        return []
+    valid_units = entity_unit_map[entity_name]
+    for item in legacy_extract_values_with_units(text):
+        value, unit = item.split(maxsplit=1)
+        if unit.lower() in valid_units:
+            return [item]
+    return []
+
+
+def synthetic_ocr_texts(count, seed=0):
+    """OCR-like strings mixing filler words, bare numbers and `<number><unit>` tokens."""
+    rng = random.Random(seed)
+    aliases = list(unit_mapping)
+    texts = []
+    for _ in range(count):
+        tokens = []
+        for _ in range(rng.randint(5, 40)):
+            roll = rng.random()
+            if roll < 0.6:
+                tokens.append(rng.choice(FILLER_WORDS))
+            elif roll < 0.8:
+                tokens.append(str(rng.randint(1, 5000)))
+            else:
+                value = rng.choice([str(rng.randint(1, 999)), f"{rng.uniform(0, 100):.1f}"])
+                tokens.append(value + rng.choice(['', ' ']) + rng.choice(aliases).upper() * (rng.random() < 0.1))
+        texts.append(' '.join(tokens))
+    return texts
+
+
+def _time(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(*item)
+    return time.perf_counter() - start
+
+
+def bench_units(count=20000, seed=0):
+    """Time the compiled matcher against the legacy alternation regex on synthetic OCR text."""
+    texts = synthetic_ocr_texts(count, seed)
+    entities = list(entity_unit_map)
+    rng = random.Random(seed)
+    pairs = [(rng.choice(entities), text) for text in texts]
+
+    legacy_extract = _time(legacy_extract_values_with_units, [(text,) for text in texts])
+    matcher_extract = _time(unit_matcher.findall, [(text,) for text in texts])
+    legacy_entity = _time(legacy_get_value_for_entity, pairs)
+    matcher_entity = _time(get_value_for_entity, pairs)
+
+    def as_float(result):
+        if not result:
+            return None
+        value, unit = result[0].split(maxsplit=1)
+        return float(value), unit
+
+    agree = sum(as_float(legacy_get_value_for_entity(*pair)) == as_float(get_value_for_entity(*pair)) for pair in pairs)
+    return {
+        'texts': count,
+        'extract_all': {'legacy_s': legacy_extract, 'matcher_s': matcher_extract,
+                        'speedup': legacy_extract / matcher_extract},
+        'entity_lookup': {'legacy_s': legacy_entity, 'matcher_s': matcher_entity,
+                          'speedup': legacy_entity / matcher_entity},
+        'entity_agreement': agree / count,
+    }
+
+
+def bench_frame(count=100000, seed=0):
+    """Time the row-by-row get_value_for_entity loop against the vectorized predict_frame."""
+    rng = random.Random(seed)
+    texts = synthetic_ocr_texts(count, seed)
+    df = pd.DataFrame({'text': texts, 'entity_name': [rng.choice(list(entity_unit_map)) for _ in texts]})
+
+    start = time.perf_counter()
+    looped = []
+    for entity_name, text in zip(df['entity_name'], df['text']):
+        result = get_value_for_entity(entity_name, text)
+        looped.append(result[0] if result else None)
+    loop_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = predict_frame(df)
+    frame_s = time.perf_counter() - start
+
+    return {
+        'rows': count,
+        'loop_s': loop_s,
+        'frame_s': frame_s,
+        'speedup': loop_s / frame_s,
+        'agreement': sum(a == b for a, b in zip(looped, vectorized)) / count,
+    }
+
+
+PREPROCESS_GRID = [
+    Preprocessor(),
+    Preprocessor(max_side=1600),
+    Preprocessor(max_side=1280),
+    Preprocessor(max_side=1024),
+    Preprocessor(max_side=768),
+    Preprocessor(max_side=1024, grayscale=True),
+    Preprocessor(max_side=1024, reduced='auto'),
+    Preprocessor(max_side=1024, grayscale=True, reduced='auto'),
+    Preprocessor(max_side=1024, grayscale=True, contrast=True),
+]
+
+
+def is_correct(prediction, entity_value):
+    """Compare a prediction with a labelled `entity_value` on parsed number and unit."""
+    if not prediction:
+        return False
+    try:
+        return parse_string(prediction) == parse_string(entity_value)
+    except ValueError:
+        return False
+
+
+def load_labelled_images(labels_filename, sample=200, seed=0):
+    """Sample labelled rows (train.csv layout) and download each image once."""
+    labels = pd.read_csv(labels_filename, usecols=['image_link', 'entity_name', 'entity_value'])
+    labels = labels.sample(n=min(sample, len(labels)), random_state=seed).reset_index(drop=True)
+    images = {}
+    for image_link in labels['image_link'].unique():
+        try:
+            images[image_link] = fetch_image_bytes(image_link)
+        except Exception as e:
+            print(f"Skipping {image_link}: {e}")
+    return labels[labels['image_link'].isin(images)].reset_index(drop=True), images
+
+
+def bench_preprocess(labels_filename, sample=200, seed=0, grid=PREPROCESS_GRID):
+    """Accuracy vs latency of each preprocessing setting on a labelled sample."""
+    labels, images = load_labelled_images(labels_filename, sample, seed)
+    service = get_reader_service()
+    service.reader
+    report = []
+    for preprocessor in grid:
+        texts = {}
+        decode_s = ocr_s = 0.0
+        for image_link, data in images.items():
+            start = time.perf_counter()
+            image = preprocessor(data)
+            decode_s += time.perf_counter() - start
+            start = time.perf_counter()
+            texts[image_link] = ' '.join(item[1] for item in service.readtext(image))
+            ocr_s += time.perf_counter() - start
+        correct = predicted = 0
+        for row in labels.itertuples():
+            result = get_value_for_entity(row.entity_name, texts[row.image_link])
+            prediction = result[0] if result else None
+            predicted += prediction is not None
+            correct += is_correct(prediction, row.entity_value)
+        report.append({
+            'preprocess': preprocessor.config(),
+            'images': len(images),
+            'decode_ms_per_image': 1000 * decode_s / len(images),
+            'ocr_ms_per_image': 1000 * ocr_s / len(images),
+            'coverage': predicted / len(labels),
+            'accuracy': correct / len(labels),
+        })
+        print(json.dumps(report[-1]))
+    return report
+
+
+def render_product_image(text, rng, width=640, height=480):
+    """Draw a plain product shot: a light background, a few shapes, filler words and the measurement text."""
+    image = np.full((height, width, 3), rng.randint(200, 255), np.uint8)
+    for _ in range(rng.randint(1, 4)):
+        x, y = rng.randint(0, width - 100), rng.randint(0, height - 100)
+        color = tuple(rng.randint(60, 220) for _ in range(3))
+        cv2.rectangle(image, (x, y), (x + rng.randint(40, 200), y + rng.randint(40, 200)), color, -1)
+    for line in range(rng.randint(0, 3)):
+        words = ' '.join(rng.choice(FILLER_WORDS) for _ in range(rng.randint(1, 4)))
+        cv2.putText(image, words, (20, 40 + 50 * line), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (40, 40, 40), 2)
+    cv2.putText(image, text, (rng.randint(10, width // 3), rng.randint(height // 2, height - 30)),
+                cv2.FONT_HERSHEY_SIMPLEX, rng.uniform(1.2, 2.0), (0, 0, 0), 3)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def synthetic_product_images(count, seed=0):
+    """Labelled rows in the test.csv layout plus the rendered `text`, and the JPEG bytes of each image.
+
+    Every image shows one measurement such as "250 ml" or "12 inch"."""
+    rng = random.Random(seed)
+    # The Hershey fonts only draw ASCII
+    aliases = {}
+    for alias, unit in unit_mapping.items():
+        if alias.isascii():
+            aliases.setdefault(unit, []).append(alias)
+    rows, images = [], {}
+    for index in range(count):
+        entity_name = rng.choice(list(entity_unit_map))
+        unit = rng.choice(sorted(unit for unit in entity_unit_map[entity_name] if unit in aliases))
+        value = rng.choice([rng.randint(1, 999), round(rng.uniform(0.5, 99.5), 1)])
+        filename = f"{index}.jpg"
+        text = f"{value} {rng.choice(aliases[unit])}"
+        images[filename] = render_product_image(text, rng)
+        rows.append({'index': index, 'image_link': filename, 'group_id': 0, 'entity_name': entity_name,
+                     'entity_value': f"{float(value)} {unit}", 'text': text})
+    return pd.DataFrame(rows), images
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_directory(folder):
+    """Serve `folder` over HTTP on a free local port and yield its base URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MiB."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    usage = [resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return {'self': usage[0] * scale / 1024 ** 2, 'children': usage[1] * scale / 1024 ** 2}
+
+
+def stage_report(rows, seconds, latencies=None):
+    """Throughput, per-row latency percentiles and the RSS high-water mark after a stage."""
+    latencies = np.asarray(latencies if latencies is not None else [], dtype=float)
+    return {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else None,
+        'p50_ms': 1000 * float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p99_ms': 1000 * float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _timed_stage(fn, items):
+    latencies = []
+    results = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        results.append(fn(*item))
+        latencies.append(time.perf_counter() - item_start)
+    return results, stage_report(len(items), time.perf_counter() - start, latencies)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(count=200, seed=0, allow_multiprocessing=False, skip_ocr=False, work_dir=None):
+    """Time every prediction stage on its own over synthetic product images served from localhost.
+
+    Stages: `download_images` into a folder, the in-memory `fetch_image`
+    path, decode, OCR, `extract_values_with_units`, `get_value_for_entity`
+    and `sanity_check`. With `skip_ocr`, the rendered text stands in for the
+    OCR output so the stages after it can still be timed without EasyOCR.
+    """
+    labels, images = synthetic_product_images(count, seed)
+    work_dir = work_dir or tempfile.mkdtemp(prefix='pipeline_bench_')
+    served = os.path.join(work_dir, 'served')
+    downloaded = os.path.join(work_dir, 'downloaded')
+    os.makedirs(served, exist_ok=True)
+    for filename, data in images.items():
+        with open(os.path.join(served, filename), 'wb') as f:
+            f.write(data)
+
+    stages = {}
+    with serve_directory(served) as base_url:
+        links = [base_url + filename for filename in labels['image_link']]
+
+        start = time.perf_counter()
+        download_images(links, downloaded, allow_multiprocessing=allow_multiprocessing)
+        stages['download_images'] = stage_report(len(links), time.perf_counter() - start)
+
+        fetched, stages['fetch_image'] = _timed_stage(
+            lambda link: not isinstance(fetch_image(link), MissingImage), [(link,) for link in links])
+
+    encoded = []
+    for filename in labels['image_link']:
+        with open(os.path.join(downloaded, filename), 'rb') as f:
+            encoded.append(f.read())
+    decoded, stages['decode'] = _timed_stage(decode_image, [(data,) for data in encoded])
+
+    if skip_ocr:
+        texts = labels['text'].tolist()
+    else:
+        service = get_reader_service()
+        service.reader
+        results, stages['ocr'] = _timed_stage(service.readtext, [(image,) for image in decoded])
+        texts = [' '.join(item[1] for item in result) for result in results]
+
+    _, stages['extract_values_with_units'] = _timed_stage(extract_values_with_units, [(text,) for text in texts])
+    predictions, stages['get_value_for_entity'] = _timed_stage(
+        get_value_for_entity, list(zip(labels['entity_name'], texts)))
+    predictions = [result[0] if result else '' for result in predictions]
+
+    test_filename = os.path.join(work_dir, 'test.csv')
+    output_filename = os.path.join(work_dir, 'test_out.csv')
+    labels.drop(columns=['entity_value', 'text']).to_csv(test_filename, index=False)
+    pd.DataFrame({'index': labels['index'], 'prediction': predictions}).to_csv(output_filename, index=False)
+    start = time.perf_counter()
+    sanity_check(test_filename, output_filename)
+    stages['sanity_check'] = stage_report(len(labels), time.perf_counter() - start)
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'count': count, 'seed': seed, 'allow_multiprocessing': allow_multiprocessing, 'skip_ocr': skip_ocr},
+        'fetched': sum(fetched),
+        'accuracy': sum(is_correct(prediction, value) for prediction, value in zip(predictions, labels['entity_value'])) / count,
+        'stages': stages,
+    }
+
+
+def compare_reports(report, baseline):
+    """Rows/sec of each stage relative to a baseline report from another commit."""
+    return {
+        stage: report['stages'][stage]['rows_per_sec'] / baseline['stages'][stage]['rows_per_sec']
+        for stage in report['stages']
+        if stage in baseline['stages'] and report['stages'][stage]['rows_per_sec']
+        and baseline['stages'][stage]['rows_per_sec']
+    }
+
+
+def _ocr_box(text, rng, y, height, confidence):
+    width = 12 * len(text) * height / 20
+    x = rng.randint(0, 200)
+    return [[x, y], [x + width, y], [x + width, y + height], [x, y + height]], text, confidence
+
+
+def _plausible_value(entity_name, unit, rng):
+    low, high = PLAUSIBLE_RANGES[entity_name]
+    for _ in range(20):
+        value = rng.choice([rng.randint(1, 999), round(rng.uniform(0.5, 99.5), 1)])
+        if low <= to_base(value, unit)[0] <= high:
+            return value
+    return value
+
+
+def synthetic_ocr_results(count, seed=0):
+    """Labelled rows and EasyOCR-like results with the answer among distractors.
+
+    Each result has the labelled measurement in a tall, confident box, often
+    next to a keyword for the entity, mixed in random order with filler text
+    and small-print measurements of the same dimension: serving sizes, values
+    outside the entity's plausible range and the like. Returns a DataFrame with
+    `entity_name` and `entity_value` columns and the list of results.
+    """
+    rng = random.Random(seed)
+    aliases = {}
+    for alias, unit in unit_mapping.items():
+        aliases.setdefault(unit, []).append(alias)
+    rows, results = [], []
+    for _ in range(count):
+        entity_name = rng.choice(list(entity_unit_map))
+        units = sorted(entity_unit_map[entity_name])
+        unit = rng.choice(units)
+        value = _plausible_value(entity_name, unit, rng)
+        texts = [rng.choice(FILLER_WORDS) + ' ' + rng.choice(FILLER_WORDS) for _ in range(rng.randint(0, 4))]
+        boxes = [(text, rng.randint(10, 20), rng.uniform(0.3, 0.95)) for text in texts]
+        for _ in range(rng.randint(0, 3)):
+            distractor = rng.choice(units)
+            distractor_value = rng.choice([rng.randint(1, 99), rng.randint(1000, 99999), round(rng.uniform(0, 1), 2)])
+            prefix = rng.choice(['per', 'serving', 'pack of 2 x', '', 'model', 'approx'])
+            boxes.append((f"{prefix} {distractor_value} {rng.choice(aliases[distractor])}".strip(),
+                          rng.randint(8, 20), rng.uniform(0.3, 0.9)))
+        headline = f"{value} {rng.choice(aliases[unit])}"
+        if rng.random() < 0.6:
+            headline = rng.choice(ENTITY_KEYWORDS[entity_name]).title() + ' ' + headline
+        boxes.insert(rng.randint(0, len(boxes)), (headline, rng.randint(24, 72), rng.uniform(0.6, 0.99)))
+        y = 0
+        result = []
+        for text, height, confidence in boxes:
+            result.append(_ocr_box(text, rng, y, height, confidence))
+            y += height + rng.randint(4, 30)
+        results.append(result)
+        rows.append({'entity_name': entity_name, 'entity_value': f"{float(value)} {unit}"})
+    return pd.DataFrame(rows), results
+
+
+def _labelled_ocr_results(labels_filename, sample=200, seed=0):
+    """OCR results of a labelled sample, read from or added to the OCR cache."""
+    labels, images = load_labelled_images(labels_filename, sample, seed)
+    service = get_reader_service()
+    cache = get_ocr_cache()
+    by_link = {}
+    for image_link, data in images.items():
+        digest = content_hash(data)
+        result = cache.get(digest)
+        if result is None:
+            result = service.readtext(decode_image(data))
+            cache.put(digest, result)
+        by_link[image_link] = result
+    return labels, [by_link[image_link] for image_link in labels['image_link']]
+
+
+def bench_ranking(labels_filename=None, sample=200, count=2000, seed=0, ranker=None):
+    """Accuracy and latency of candidate ranking against the first-match rule on the same OCR results.
+
+    With `labels_filename` (train.csv layout) a labelled sample is OCR'd once;
+    otherwise `synthetic_ocr_results` stands in, which only shows the cost of
+    ranking and that it recovers a headline value among distractors.
+    """
+    if labels_filename:
+        labels, results = _labelled_ocr_results(labels_filename, sample, seed)
+    else:
+        labels, results = synthetic_ocr_results(count, seed)
+    ranker = ranker or CandidateRanker()
+    pairs = list(zip(labels['entity_name'], results))
+
+    def first_match(entity_name, result):
+        match = get_value_for_entity(entity_name, ' '.join(item[1] for item in result))
+        return match[0] if match else None
+
+    def ranked(entity_name, result):
+        match = ranker.rank(result, entity_name)
+        return format_match(match) if match else None
+
+    report = {'source': labels_filename or 'synthetic', 'rows': len(pairs)}
+    correct = {}
+    for name, rule in (('first_match', first_match), ('ranked', ranked)):
+        predictions, stage = _timed_stage(rule, pairs)
+        correct[name] = np.array([is_correct(prediction, value)
+                                  for prediction, value in zip(predictions, labels['entity_value'])], dtype=bool)
+        report[name] = {
+            'accuracy': float(correct[name].mean()) if len(pairs) else None,
+            'coverage': sum(prediction is not None for prediction in predictions) / len(pairs) if len(pairs) else None,
+            'us_per_row': 1e6 * stage['seconds'] / len(pairs) if len(pairs) else None,
+            'p99_us': 1000 * stage['p99_ms'] if stage['p99_ms'] is not None else None,
+        }
+    report['ranked_only_correct'] = int((correct['ranked'] & ~correct['first_match']).sum())
+    report['first_match_only_correct'] = int((correct['first_match'] & ~correct['ranked']).sum())
+    return report
+
+
+if __name__ == "__main__":
+    #Usage example: python benchmark.py units --count 50000
+    #               python benchmark.py frame --count 1000000
+    #               python benchmark.py preprocess --labels_filename ../dataset/train.csv --sample 200
+    #               python benchmark.py pipeline --count 500 --output_filename bench.json --baseline_filename bench_main.json
+    #               python benchmark.py ranking --labels_filename ../dataset/train.csv --sample 500
+
+    parser = argparse.ArgumentParser(description="Benchmark the prediction hot paths.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    units_parser = subparsers.add_parser("units", help="Compiled unit matcher vs the legacy regex.")
+    units_parser.add_argument("--count", type=int, default=20000, help="Number of synthetic OCR texts.")
+    units_parser.add_argument("--seed", type=int, default=0)
+    frame_parser = subparsers.add_parser("frame", help="Vectorized DataFrame extraction vs the per-row loop.")
+    frame_parser.add_argument("--count", type=int, default=100000, help="Number of synthetic OCR rows.")
+    frame_parser.add_argument("--seed", type=int, default=0)
+    preprocess_parser = subparsers.add_parser("preprocess", help="Accuracy vs OCR latency of preprocessing settings.")
+    preprocess_parser.add_argument("--labels_filename", type=str, required=True, help="Labelled CSV in the train.csv layout.")
+    preprocess_parser.add_argument("--sample", type=int, default=200, help="Number of labelled rows to sample.")
+    preprocess_parser.add_argument("--seed", type=int, default=0)
+    preprocess_parser.add_argument("--output_filename", type=str, default=None, help="Write the report as JSON.")
+    pipeline_parser = subparsers.add_parser("pipeline", help="Per-stage throughput of the whole pipeline on synthetic images.")
+    pipeline_parser.add_argument("--count", type=int, default=200, help="Number of synthetic product images.")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--allow_multiprocessing", action="store_true", help="Run download_images with its process pool.")
+    pipeline_parser.add_argument("--skip_ocr", action="store_true", help="Use the rendered text instead of running EasyOCR.")
+    pipeline_parser.add_argument("--work_dir", type=str, default=None, help="Folder for the served and downloaded images.")
+    pipeline_parser.add_argument("--output_filename", type=str, default=None, help="Write the report as JSON.")
+    pipeline_parser.add_argument("--baseline_filename", type=str, default=None, help="Report from another commit to compare rows/sec with.")
+    ranking_parser = subparsers.add_parser("ranking", help="Candidate ranking vs the first-match rule on labelled OCR results.")
+    ranking_parser.add_argument("--labels_filename", type=str, default=None, help="Labelled CSV in the train.csv layout (default: synthetic OCR results).")
+    ranking_parser.add_argument("--sample", type=int, default=200, help="Number of labelled rows to sample.")
+    ranking_parser.add_argument("--count", type=int, default=2000, help="Number of synthetic OCR results without --labels_filename.")
+    ranking_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "units":
+        print(json.dumps(bench_units(args.count, args.seed), indent=2))
+    elif args.command == "frame":
+        print(json.dumps(bench_frame(args.count, args.seed), indent=2))
+    elif args.command == "preprocess":
+        report = bench_preprocess(args.labels_filename, args.sample, args.seed)
+        if args.output_filename:
+            with open(args.output_filename, 'w') as f:
+                json.dump(report, f, indent=2)
+    elif args.command == "ranking":
+        print(json.dumps(bench_ranking(args.labels_filename, args.sample, args.count, args.seed), indent=2))
+    elif args.command == "pipeline":
+        report = bench_pipeline(args.count, args.seed, args.allow_multiprocessing, args.skip_ocr, args.work_dir)
+        if args.baseline_filename:
+            with open(args.baseline_filename) as f:
+                report['speedup_vs_baseline'] = compare_reports(report, json.load(f))
+        print(json.dumps(report, indent=2))
+        if args.output_filename:
+            with open(args.output_filename, 'w') as f:
+                json.dump(report, f, indent=2)
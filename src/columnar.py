@@ -0,0 +1,248 @@
+import os
+import time
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+
+# One row per OCR'd image. `text` is the joined readtext output the first-match rule reads; the list
+# columns keep each box so the candidate ranker can re-score without OCR'ing again.
+OCR_TEXT_SCHEMA = pa.schema([
+    ('image_link', pa.string()),
+    ('content_hash', pa.string()),
+    ('text', pa.string()),
+    ('texts', pa.list_(pa.string())),
+    ('confidences', pa.list_(pa.float32())),
+    ('boxes', pa.list_(pa.list_(pa.float32()))),
+])
+
+
+def prediction_schema(index):
+    """Schema of an `index,prediction` file whose index has the type of the Series `index`."""
+    index_type = pa.Schema.from_pandas(index.to_frame('index'), preserve_index=False).field('index').type
+    return pa.schema([('index', index_type), ('prediction', pa.string())])
+
+
+def is_parquet(filename):
+    return str(filename).lower().endswith(PARQUET_SUFFIXES)
+
+
+def column_names(filename):
+    """Column names of a CSV or Parquet file, without reading its rows."""
+    if is_parquet(filename):
+        return pq.read_schema(filename).names
+    return list(pd.read_csv(filename, nrows=0).columns)
+
+
+def read_frame(filename, columns=None):
+    """Read only `columns` of a CSV or Parquet file into a DataFrame."""
+    if is_parquet(filename):
+        return pq.read_table(filename, columns=columns).to_pandas()
+    return pd.read_csv(filename, usecols=columns)
+
+
+def iter_frames(filename, columns=None, chunk_size=100000, dtype=None):
+    """Yield DataFrames of at most `chunk_size` rows holding only `columns` of a CSV or Parquet file.
+
+    Parquet files are streamed batch by batch from their row groups, and
+    columns that are not asked for are never read from disk.
+    """
+    if is_parquet(filename):
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunk_size, columns=columns):
+            frame = batch.to_pandas()
+            yield frame.astype(dtype) if dtype else frame
+    else:
+        yield from pd.read_csv(filename, usecols=columns, chunksize=chunk_size, dtype=dtype)
+
+
+class FrameWriter:
+    """Write DataFrames to a Parquet file one row group at a time.
+
+    The file is written next to `filename` and moved into place on `close`,
+    so readers never see a half-written file.
+    """
+
+    def __init__(self, filename, schema, row_group_size=100000):
+        self.filename = filename
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self._tmp_filename = filename + '.tmp'
+        self._writer = pq.ParquetWriter(self._tmp_filename, schema)
+
+    def write(self, frame):
+        table = pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+
+    def write_table(self, table):
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_filename, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class OCRTextWriter:
+    """Persist `readtext` results as a Parquet table with the `OCR_TEXT_SCHEMA` columns.
+
+    Rows are buffered and committed on `flush` (and every `row_group_size`
+    images) as a small part file in `<filename>.parts`, so a run killed
+    between flushes only loses its last rows. `close` merges the existing
+    table and the parts into `filename`; parts left by a killed run are
+    carried over too. An image added again in the same run is only written
+    once. Images that could not be OCR'd are added with a None result and
+    get an empty row, so readers can tell them from images never seen; when
+    an image appears twice, readers keep the last row.
+    """
+
+    def __init__(self, filename, row_group_size=1024):
+        self.filename = filename
+        self.row_group_size = row_group_size
+        self.parts_dir = filename + '.parts'
+        self._rows = []
+        self._written = set()
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self._carried_over = set()
+        for source in self._sources():
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=65536, columns=['image_link']):
+                self._carried_over.update(batch.column('image_link').to_pylist())
+
+    def _sources(self):
+        parts = [os.path.join(self.parts_dir, name) for name in sorted(os.listdir(self.parts_dir))
+                 if name.endswith('.parquet')]
+        return ([self.filename] if os.path.exists(self.filename) else []) + parts
+
+    def __contains__(self, image_link):
+        return image_link in self._written or image_link in self._carried_over
+
+    def add(self, image_link, content_hash, ocr_result):
+        if image_link in self._written:
+            return
+        self._written.add(image_link)
+        self._rows.append((image_link, content_hash, ocr_result))
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Commit the buffered rows to a new part file."""
+        if not self._rows:
+            return
+        image_links, hashes, results = zip(*self._rows)
+        self._rows = []
+        texts = [None if result is None else [item[1] for item in result] for result in results]
+        table = pa.Table.from_pydict({
+            'image_link': list(image_links),
+            'content_hash': list(hashes),
+            'text': [None if items is None else ' '.join(items) for items in texts],
+            'texts': texts,
+            'confidences': [None if result is None else [float(item[2]) for item in result] for result in results],
+            'boxes': [None if result is None else [[float(value) for point in item[0] for value in point]
+                                                   for item in result] for result in results],
+        }, schema=OCR_TEXT_SCHEMA)
+        part_filename = os.path.join(self.parts_dir, f"{time.time_ns()}-{os.getpid()}.parquet")
+        with open(part_filename + '.tmp', 'wb') as f:
+            pq.write_table(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_filename + '.tmp', part_filename)
+
+    def close(self):
+        """Merge the existing table and every part into `filename`."""
+        self.flush()
+        # The parts are many small tables, so they are regrouped into full row groups
+        writer = FrameWriter(self.filename, OCR_TEXT_SCHEMA, self.row_group_size)
+        tables, rows = [], 0
+        for source in self._sources():
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=self.row_group_size):
+                tables.append(pa.Table.from_batches([batch]).cast(OCR_TEXT_SCHEMA))
+                rows += batch.num_rows
+                if rows >= self.row_group_size:
+                    writer.write_table(pa.concat_tables(tables))
+                    tables, rows = [], 0
+        if tables:
+            writer.write_table(pa.concat_tables(tables))
+        writer.close()
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_ocr_texts(filename, batch_size=65536):
+    """{image_link: joined OCR text, or None if it could not be OCR'd}, reading only those two columns."""
+    texts = {}
+    for batch in pq.ParquetFile(filename).iter_batches(batch_size=batch_size, columns=['image_link', 'text']):
+        texts.update(zip(batch.column('image_link').to_pylist(), batch.column('text').to_pylist()))
+    return texts
+
+
+def read_ocr_results(filename, batch_size=65536):
+    """{image_link: readtext result, or None} rebuilt from the per-box columns of an OCR-text table."""
+    results = {}
+    columns = ['image_link', 'texts', 'confidences', 'boxes']
+    for batch in pq.ParquetFile(filename).iter_batches(batch_size=batch_size, columns=columns):
+        for image_link, texts, confidences, boxes in zip(*(batch.column(name).to_pylist() for name in columns)):
+            if texts is None:
+                results[image_link] = None
+                continue
+            corners = [np.asarray(box, dtype=float).reshape(-1, 2).tolist() for box in boxes]
+            results[image_link] = list(zip(corners, texts, confidences))
+    return results
+
+
+def export_csv(filename, csv_filename, columns=('index', 'prediction'), chunk_size=100000):
+    """Stream `columns` of a Parquet file into a CSV, e.g. the final submission file."""
+    tmp_filename = csv_filename + '.tmp'
+    header = True
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as f:
+        for frame in iter_frames(filename, list(columns), chunk_size):
+            frame.to_csv(f, index=False, header=header)
+            header = False
+        if header:
+            pd.DataFrame(columns=list(columns)).to_csv(f, index=False)
+    os.replace(tmp_filename, csv_filename)
+
+
+def convert_csv(csv_filename, filename, chunk_size=100000):
+    """Convert a CSV manifest to Parquet with one row group per `chunk_size` rows."""
+    writer = None
+    for frame in pd.read_csv(csv_filename, chunksize=chunk_size):
+        if writer is None:
+            writer = FrameWriter(filename, pa.Schema.from_pandas(frame, preserve_index=False), chunk_size)
+        writer.write(frame)
+    if writer is not None:
+        writer.close()
+
+
+if __name__ == "__main__":
+    #Usage example: python columnar.py convert --input_filename ../dataset/test.csv --output_filename ../dataset/test.parquet
+    #               python columnar.py export --input_filename ../dataset/test_out.parquet --output_filename ../dataset/test_out.csv
+
+    parser = argparse.ArgumentParser(description="Convert between CSV and Parquet files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Write a CSV manifest as Parquet.")
+    convert_parser.add_argument("--input_filename", type=str, required=True)
+    convert_parser.add_argument("--output_filename", type=str, required=True)
+    convert_parser.add_argument("--chunk_size", type=int, default=100000, help="Rows per row group.")
+    export_parser = subparsers.add_parser("export", help="Write Parquet predictions as the index,prediction CSV.")
+    export_parser.add_argument("--input_filename", type=str, required=True)
+    export_parser.add_argument("--output_filename", type=str, required=True)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert_csv(args.input_filename, args.output_filename, args.chunk_size)
+    elif args.command == "export":
+        export_csv(args.input_filename, args.output_filename)
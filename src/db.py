@@ -0,0 +1,19 @@
+import os
+import sqlite3
+
+
+def local_connection(local, path):
+    """This thread's connection to the SQLite database at `path`, kept in the `threading.local` `local`.
+
+    SQLite connections must not cross threads or forked processes, so a new
+    one is opened per thread and again after a fork. Connections are in
+    autocommit mode with a WAL journal, so readers do not block the writer.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
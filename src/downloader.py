@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from pathlib import Path
+from collections import namedtuple
+
+from tqdm import tqdm
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DownloadResult = namedtuple('DownloadResult', ['url', 'path', 'status', 'bytes', 'latency', 'attempts', 'error'])
+
+
+class AsyncDownloader:
+    """Bulk image downloader running on one asyncio event loop.
+
+    A single aiohttp session keeps a pool of keep-alive connections per host,
+    `concurrency` bounds the number of requests in flight and `per_host` the
+    connections opened to any one host. Failed requests are retried with
+    exponential backoff and full jitter. Bodies are streamed to disk in chunks.
+    """
+
+    def __init__(self, concurrency=64, per_host=16, retries=3, backoff=0.5, max_backoff=30.0, timeout=30,
+                 chunk_size=64 * 1024):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _fetch(self, session, url, save_folder):
+        if not isinstance(url, str):
+            return DownloadResult(url, None, 'invalid', 0, 0.0, 0, 'image link is not a string')
+
+        path = os.path.join(save_folder, Path(url).name)
+        if os.path.exists(path):
+            return DownloadResult(url, path, 'exists', os.path.getsize(path), 0.0, 0, None)
+
+        start = time.perf_counter()
+        # Per-task temp name, so two links with the same file name never write to one file
+        tmp_path = f"{path}.{id(asyncio.current_task())}.part"
+        error = None
+        attempts = 0
+        while attempts < max(1, self.retries):
+            if attempts:
+                await asyncio.sleep(self._delay(attempts))
+            attempts += 1
+            try:
+                async with session.get(url) as response:
+                    if response.status != 200:
+                        error = f"HTTP {response.status}"
+                        # Client errors will not go away on retry
+                        if 400 <= response.status < 500 and response.status != 429:
+                            break
+                        continue
+                    size = 0
+                    with open(tmp_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            f.write(chunk)
+                            size += len(chunk)
+                os.replace(tmp_path, path)
+                return DownloadResult(url, path, 'ok', size, time.perf_counter() - start, attempts, None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                error = f"{type(e).__name__}: {e}"
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return DownloadResult(url, None, 'failed', 0, time.perf_counter() - start, attempts, error)
+
+    async def download_all(self, image_links, save_folder, progress=True):
+        if aiohttp is None:
+            raise ImportError("The async downloader requires aiohttp: pip install aiohttp")
+
+        os.makedirs(save_folder, exist_ok=True)
+        # Each distinct link is fetched once and its result fanned back out to the duplicates
+        unique_links = list(dict.fromkeys(image_links))
+        results = [None] * len(unique_links)
+        todo = iter(enumerate(unique_links))
+        bar = tqdm(total=len(unique_links), disable=not progress)
+
+        # A fixed set of workers pulls links, so memory does not grow with the number of links
+        async def worker(session):
+            for position, url in todo:
+                results[position] = await self._fetch(session, url, save_folder)
+                bar.update()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[worker(session) for _ in range(min(self.concurrency, len(unique_links)) or 1)])
+        bar.close()
+        by_link = dict(zip(unique_links, results))
+        return [by_link[url] for url in image_links]
+
+    def download(self, image_links, save_folder, progress=True):
+        """Download every link into `save_folder` and return one DownloadResult per link, in order."""
+        return run_coroutine(self.download_all(list(image_links), save_folder, progress))
+
+
+def run_coroutine(coro):
+    """Run a coroutine to completion, even when called from a thread that already runs a loop (Jupyter)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
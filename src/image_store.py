@@ -0,0 +1,203 @@
+import os
+import mmap
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from db import local_connection
+from ocr_cache import content_hash
+
+DATA_FILENAME = 'images.bin'
+INDEX_FILENAME = 'index.sqlite3'
+
+
+class ImageStore:
+    """Packed image store: one append-only data file plus a SQLite index, read through `mmap`.
+
+    Every distinct image (by content hash) is stored once; the index maps
+    URLs to hashes and hashes to `(offset, size)` in the data file. Reads
+    return memoryviews into the mapping, so nothing is copied until the
+    bytes are decoded. Any number of processes can read; appends should come
+    from one process at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, DATA_FILENAME)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._map = None
+        self._writer = None
+        self._writer_pid = None
+        open(self.data_path, 'ab').close()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, offset INTEGER NOT NULL, size INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL)')
+
+    def _connection(self):
+        return local_connection(self._local, os.path.join(self.path, INDEX_FILENAME))
+
+    def _view(self, offset, size):
+        mapping = self._map
+        if mapping is None or offset + size > len(mapping):
+            with self._lock:
+                mapping = self._map
+                if mapping is None or offset + size > len(mapping):
+                    # The data file only grows, so remap it whole. Views into the old
+                    # mapping stay valid; it is closed once the last one is released.
+                    with open(self.data_path, 'rb') as f:
+                        mapping = self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapping)[offset:offset + size]
+
+    def get(self, url):
+        """Return the encoded bytes stored for `url` as a memoryview, or None."""
+        row = self._connection().execute(
+            'SELECT b.offset, b.size FROM urls u JOIN blobs b ON b.hash = u.hash WHERE u.url = ?', (url,)).fetchone()
+        return None if row is None else self._view(*row)
+
+    def __contains__(self, url):
+        return self._connection().execute('SELECT 1 FROM urls WHERE url = ?', (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+
+    def _data_file(self):
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = open(self.data_path, 'ab')
+            self._writer_pid = os.getpid()
+        return self._writer
+
+    def put_many(self, items):
+        """Add `(url, data)` pairs in one transaction and return their content hashes.
+
+        Images already in the store are not written again; their URLs are
+        just pointed at the existing bytes.
+        """
+        items = [(url, data, content_hash(data)) for url, data in items]
+        conn = self._connection()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                new_blobs = []
+                written = set()
+                f = self._data_file()
+                offset = f.seek(0, os.SEEK_END)
+                for _, data, digest in items:
+                    if digest in written or conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone():
+                        continue
+                    f.write(data)
+                    new_blobs.append((digest, offset, len(data)))
+                    written.add(digest)
+                    offset += len(data)
+                # The bytes must be on disk before the index points at them
+                f.flush()
+                os.fsync(f.fileno())
+                conn.executemany('INSERT INTO blobs (hash, offset, size) VALUES (?, ?, ?)', new_blobs)
+                conn.executemany('INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)',
+                                 [(url, digest) for url, _, digest in items])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return [digest for _, _, digest in items]
+
+    def put(self, url, data):
+        return self.put_many([(url, data)])[0]
+
+    def urls(self):
+        """Yield `(url, hash)` for every stored URL."""
+        yield from self._connection().execute('SELECT url, hash FROM urls').fetchall()
+
+    def import_folder(self, folder, image_links=None, batch_size=1000):
+        """One-time import of a folder written by `utils.download_images`.
+
+        With `image_links`, each link is stored under its full URL if the
+        folder has its file (named by `Path(image_link).name`); otherwise
+        every file is stored under its file name. Returns the number of
+        images imported.
+        """
+        if image_links is not None:
+            names = ((link, Path(link).name) for link in dict.fromkeys(image_links) if isinstance(link, str))
+        else:
+            names = ((entry.name, entry.name) for entry in os.scandir(folder) if entry.is_file())
+        imported = 0
+        batch = []
+        for key, name in tqdm(names, unit='images'):
+            path = os.path.join(folder, name)
+            if key in self or not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                batch.append((key, f.read()))
+            if len(batch) >= batch_size:
+                imported += len(self.put_many(batch))
+                batch = []
+        if batch:
+            imported += len(self.put_many(batch))
+        return imported
+
+    def download(self, image_links, workers=16, timeout=30, batch_size=256):
+        """Download the links that are not in the store yet. Returns the links that failed."""
+        # Imported here so reading a store does not load the OCR stack
+        from pipeline import MissingImage, fetch_image
+
+        todo = [link for link in dict.fromkeys(image_links) if isinstance(link, str) and link not in self]
+
+        def fetch(link):
+            data = fetch_image(link, timeout)
+            return link, data if isinstance(data, MissingImage) else bytes(data)
+
+        failed = []
+        batch = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for link, data in tqdm(pool.map(fetch, todo), total=len(todo), unit='images'):
+                if isinstance(data, MissingImage):
+                    failed.append(data)
+                    continue
+                batch.append((link, data))
+                if len(batch) >= batch_size:
+                    self.put_many(batch)
+                    batch = []
+        if batch:
+            self.put_many(batch)
+        return failed
+
+    def stats(self):
+        conn = self._connection()
+        urls = conn.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+        images, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return {'urls': urls, 'images': images, 'bytes': size, 'file_bytes': os.path.getsize(self.data_path)}
+
+
+if __name__ == "__main__":
+    #Usage example: python image_store.py import --store ../dataset/images.store --folder ../images --input_filename ../dataset/test.csv
+    #               python image_store.py download --store ../dataset/images.store --input_filename ../dataset/test.csv
+    # Only the CLI reads CSV/Parquet, so importers of ImageStore do not load pandas and pyarrow
+    from columnar import read_frame
+
+    parser = argparse.ArgumentParser(description="Build a packed image store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import a folder written by download_images.")
+    import_parser.add_argument("--store", type=str, required=True, help="Store directory.")
+    import_parser.add_argument("--folder", type=str, required=True, help="Folder of downloaded images.")
+    import_parser.add_argument("--input_filename", type=str, default=None, help="CSV or Parquet file whose image_link column gives the URLs of the files.")
+    download_parser = subparsers.add_parser("download", help="Download the images of a CSV into the store.")
+    download_parser.add_argument("--store", type=str, required=True, help="Store directory.")
+    download_parser.add_argument("--input_filename", type=str, required=True, help="CSV or Parquet file with an image_link column.")
+    download_parser.add_argument("--workers", type=int, default=16, help="Download threads.")
+    stats_parser = subparsers.add_parser("stats", help="Print the size of a store.")
+    stats_parser.add_argument("--store", type=str, required=True, help="Store directory.")
+    args = parser.parse_args()
+
+    store = ImageStore(args.store)
+    if args.command == "import":
+        image_links = read_frame(args.input_filename, ['image_link'])['image_link'] if args.input_filename else None
+        print(f"Imported {store.import_folder(args.folder, image_links)} images")
+    elif args.command == "download":
+        image_links = read_frame(args.input_filename, ['image_link'])['image_link']
+        failed = store.download(image_links, args.workers)
+        print(f"{len(failed)} links failed")
+    print(store.stats())
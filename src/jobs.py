@@ -0,0 +1,251 @@
+import os
+import time
+import uuid
+import argparse
+import threading
+
+import pandas as pd
+
+from columnar import read_frame
+from db import local_connection
+
+DEFAULT_JOBS_PATH = os.environ.get(
+    'JOBS_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.jobs'))
+
+JOB_COLUMNS = ['id', 'name', 'status', 'total_rows', 'done_rows', 'created', 'started', 'finished', 'heartbeat', 'error']
+
+
+class JobQueue:
+    """SQLite-backed queue of CSV prediction jobs.
+
+    A submitted CSV is copied next to the database and becomes a 'queued'
+    job. Workers claim jobs one at a time, store predictions as they are
+    produced and keep a heartbeat, so any process (a Streamlit session, the
+    CLI) can poll progress and read the finished rows. A job whose worker
+    stopped heart-beating is queued again and resumes after its stored rows.
+    """
+
+    def __init__(self, path=DEFAULT_JOBS_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, name TEXT, status TEXT NOT NULL, total_rows INTEGER NOT NULL, '
+                'done_rows INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, started REAL, finished REAL, '
+                'heartbeat REAL, error TEXT)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'job_id TEXT NOT NULL, row INTEGER NOT NULL, prediction TEXT, PRIMARY KEY (job_id, row))')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+
+    def _connection(self):
+        return local_connection(self._local, os.path.join(self.path, 'jobs.sqlite3'))
+
+    def input_path(self, job_id):
+        return os.path.join(self.path, f"{job_id}.csv")
+
+    def submit(self, input_df, name=None):
+        """Queue predictions for a DataFrame with index, image_link and entity_name columns."""
+        job_id = uuid.uuid4().hex
+        tmp_path = self.input_path(job_id) + '.tmp'
+        input_df[['index', 'image_link', 'entity_name']].to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.input_path(job_id))
+        self._connection().execute(
+            'INSERT INTO jobs (id, name, status, total_rows, created) VALUES (?, ?, ?, ?, ?)',
+            (job_id, name, 'queued', len(input_df), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    def list(self, limit=50):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+    def claim(self, stale_after=600):
+        """Mark the oldest queued job as running and return it, or None.
+
+        Running jobs without a heartbeat for `stale_after` seconds are taken
+        over as well.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+                "ORDER BY created LIMIT 1", (now - stale_after,)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started = COALESCE(started, ?), heartbeat = ? WHERE id = ?",
+                    (now, now, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get(row[0]) if row else None
+
+    def done_rows(self, job_id):
+        """Row positions that already have a stored prediction."""
+        return {row for row, in self._connection().execute('SELECT row FROM results WHERE job_id = ?', (job_id,))}
+
+    def record(self, job_id, rows):
+        """Store `(row, prediction)` pairs and refresh the heartbeat. Returns the job status."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO results (job_id, row, prediction) VALUES (?, ?, ?)',
+                             [(job_id, row, prediction) for row, prediction in rows])
+            conn.execute(
+                'UPDATE jobs SET done_rows = (SELECT COUNT(*) FROM results WHERE job_id = ?), heartbeat = ? '
+                'WHERE id = ?', (job_id, time.time(), job_id))
+            status = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return status
+
+    def finish(self, job_id, error=None):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ? AND status = 'running'",
+            ('failed' if error else 'done', time.time(), error, job_id))
+
+    def cancel(self, job_id):
+        self._connection().execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id))
+
+    def input_index(self, job_id):
+        """The `index` column of the job's input, by row position."""
+        return pd.read_csv(self.input_path(job_id), usecols=['index'])['index'].to_numpy()
+
+    def results(self, job_id, last=None, index=None):
+        """The rows predicted so far, in input order, as an `index,prediction` DataFrame.
+
+        With `last`, only the `last` highest rows are read, which is cheap
+        enough to poll. Pass the job's `input_index` as `index` to skip
+        reading the input file.
+        """
+        query = 'SELECT row, prediction FROM results WHERE job_id = ? ORDER BY row'
+        params = (job_id,)
+        if last is not None:
+            query = f'SELECT * FROM ({query} DESC LIMIT ?) ORDER BY row'
+            params += (last,)
+        stored = pd.read_sql_query(query, self._connection(), params=params)
+        index = self.input_index(job_id) if index is None else index
+        return pd.DataFrame({'index': index[stored['row'].to_numpy()],
+                             'prediction': stored['prediction'].fillna('').to_numpy()})
+
+
+class JobWorker:
+    """Runs queued jobs one after another through a single staged pipeline.
+
+    All jobs share the worker's OCR pool, so the models are loaded once per
+    worker however many users queue jobs. Predictions are written to the
+    queue every `flush_every` rows or `flush_interval` seconds; cancelling a
+    job stops it at the next write.
+    """
+
+    def __init__(self, queue, download_workers=16, ocr_workers=None, ocr_batch_size=8, poll_interval=1.0,
+                 flush_every=100, flush_interval=2.0):
+        self.queue = queue
+        self.download_workers = download_workers
+        self.ocr_workers = ocr_workers
+        self.ocr_batch_size = ocr_batch_size
+        self.poll_interval = poll_interval
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+
+    def _pipeline(self):
+        # Imported here so the queue can be polled without loading the OCR stack
+        from ocr_cache import get_ocr_cache, reader_config_key
+        from pipeline import StagedPipeline
+
+        cache = get_ocr_cache(config_key=reader_config_key(batch_size=self.ocr_batch_size))
+        return StagedPipeline(download_workers=self.download_workers, ocr_workers=self.ocr_workers,
+                              cache=cache, ocr_batch_size=self.ocr_batch_size)
+
+    def run_job(self, job):
+        from predict import format_prediction, predict_rows
+
+        input_df = pd.read_csv(self.queue.input_path(job['id']))
+        done = self.queue.done_rows(job['id'])
+        todo = [row for row in range(len(input_df)) if row not in done]
+        image_links = input_df['image_link'].to_numpy()[todo].tolist()
+        entity_names = input_df['entity_name'].to_numpy()[todo].tolist()
+
+        pending = []
+        last_flush = time.monotonic()
+        for positions, predictions in predict_rows(image_links, entity_names, self._pipeline()):
+            pending.extend((todo[position], format_prediction(prediction))
+                           for position, prediction in zip(positions, predictions))
+            if len(pending) >= self.flush_every or time.monotonic() - last_flush >= self.flush_interval:
+                status = self.queue.record(job['id'], pending)
+                pending, last_flush = [], time.monotonic()
+                if status != 'running':
+                    return
+        self.queue.record(job['id'], pending)
+        self.queue.finish(job['id'])
+
+    def run_once(self):
+        """Run the next queued job, if any. Returns whether one was run."""
+        job = self.queue.claim()
+        if job is None:
+            return False
+        try:
+            self.run_job(job)
+        except Exception as e:
+            self.queue.finish(job['id'], error=f"{type(e).__name__}: {e}")
+        return True
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Run the worker on a daemon thread of this process."""
+        thread = threading.Thread(target=self.run_forever, name='job-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    #Usage example: python jobs.py worker --ocr_workers 4
+    #               python jobs.py submit --input_filename ../dataset/test.csv
+    #               python jobs.py status
+
+    parser = argparse.ArgumentParser(description="Queue CSV prediction jobs and run them in the background.")
+    parser.add_argument("--jobs_path", type=str, default=DEFAULT_JOBS_PATH, help="Folder holding the job queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run queued jobs until interrupted.")
+    worker_parser.add_argument("--download_workers", type=int, default=16, help="Download threads.")
+    worker_parser.add_argument("--ocr_workers", type=int, default=None, help="OCR worker processes (default: all cores).")
+    worker_parser.add_argument("--ocr_batch_size", type=int, default=8, help="Images per batched OCR call.")
+    submit_parser = subparsers.add_parser("submit", help="Queue a CSV or Parquet file with index, image_link and entity_name columns.")
+    submit_parser.add_argument("--input_filename", type=str, required=True)
+    subparsers.add_parser("status", help="List recent jobs.")
+    results_parser = subparsers.add_parser("results", help="Write the rows predicted so far.")
+    results_parser.add_argument("--job_id", type=str, required=True)
+    results_parser.add_argument("--output_filename", type=str, required=True)
+    args = parser.parse_args()
+
+    queue = JobQueue(args.jobs_path)
+    if args.command == "worker":
+        JobWorker(queue, args.download_workers, args.ocr_workers, args.ocr_batch_size).run_forever()
+    elif args.command == "submit":
+        print(queue.submit(read_frame(args.input_filename), os.path.basename(args.input_filename)))
+    elif args.command == "status":
+        print(pd.DataFrame(queue.list()).to_string(index=False))
+    elif args.command == "results":
+        queue.results(args.job_id).to_csv(args.output_filename, index=False)
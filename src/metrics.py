@@ -0,0 +1,150 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+def classify_exception(error):
+    """Map an exception to a coarse failure kind for the error counters."""
+    name = type(error).__name__
+    if isinstance(error, TimeoutError) or 'Timeout' in name:
+        return 'timeout'
+    if isinstance(error, ConnectionError) or 'Connection' in name:
+        return 'connection'
+    if 'HTTP' in name or 'Status Code' in str(error):
+        return 'http'
+    if type(error).__module__.startswith('cv2') or 'decode' in str(error).lower():
+        return 'decode'
+    if isinstance(error, MemoryError):
+        return 'memory'
+    if isinstance(error, (FileNotFoundError, PermissionError)):
+        return 'file'
+    if isinstance(error, OSError):
+        return 'io'
+    if isinstance(error, (ValueError, TypeError, KeyError, IndexError)):
+        return 'value'
+    return 'other'
+
+
+class Metrics:
+    """Per-stage wall/CPU timers, event counters and error counts for one process.
+
+    `stage(name)` times a block with `perf_counter` and the calling thread's
+    CPU clock, and counts any exception escaping it under
+    `(stage, classify_exception(error))`. Updates are a few additions under
+    a lock, cheap enough to leave on. `drain` and `merge` move the numbers
+    of a worker process into its parent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.errors = {}
+
+    def observe(self, stage, wall, cpu=0.0):
+        with self._lock:
+            calls, wall_total, cpu_total, wall_max = self.stages.get(stage, (0, 0.0, 0.0, 0.0))
+            self.stages[stage] = (calls + 1, wall_total + wall, cpu_total + cpu, max(wall_max, wall))
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        except BaseException as e:
+            self.record_error(name, e)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_error(self, stage, error):
+        """Count `error` once, under the innermost stage it passed through."""
+        if getattr(error, '_metrics_stage', None) is not None:
+            return
+        try:
+            error._metrics_stage = stage
+        except AttributeError:
+            pass
+        key = (stage, classify_exception(error))
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'stages': dict(self.stages), 'counters': dict(self.counters), 'errors': dict(self.errors)}
+
+    def drain(self):
+        """Return a snapshot and reset, so a worker reports each event once."""
+        with self._lock:
+            snapshot = {'stages': self.stages, 'counters': self.counters, 'errors': self.errors}
+            self.stages, self.counters, self.errors = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        with self._lock:
+            for stage, (calls, wall_total, cpu_total, wall_max) in snapshot['stages'].items():
+                old = self.stages.get(stage, (0, 0.0, 0.0, 0.0))
+                self.stages[stage] = (old[0] + calls, old[1] + wall_total, old[2] + cpu_total, max(old[3], wall_max))
+            for counter, value in snapshot['counters'].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+            for key, value in snapshot['errors'].items():
+                self.errors[key] = self.errors.get(key, 0) + value
+
+    def stage_rows(self):
+        """One row per stage: calls, total and mean wall time, CPU time and the slowest call."""
+        snapshot = self.snapshot()
+        errors = {}
+        for (stage, _), count in snapshot['errors'].items():
+            errors[stage] = errors.get(stage, 0) + count
+        return [
+            {'stage': stage, 'calls': calls, 'wall_s': wall_total, 'cpu_s': cpu_total,
+             'mean_ms': 1000 * wall_total / calls if calls else 0.0, 'max_ms': 1000 * wall_max,
+             'errors': errors.get(stage, 0)}
+            for stage, (calls, wall_total, cpu_total, wall_max) in sorted(snapshot['stages'].items())
+        ]
+
+    def summary_table(self):
+        """Plain-text table of the stages, counters and errors."""
+        lines = [f"{'stage':<28}{'calls':>10}{'wall_s':>12}{'cpu_s':>12}{'mean_ms':>12}{'max_ms':>12}{'errors':>8}"]
+        for row in self.stage_rows():
+            lines.append(f"{row['stage']:<28}{row['calls']:>10}{row['wall_s']:>12.3f}{row['cpu_s']:>12.3f}"
+                         f"{row['mean_ms']:>12.2f}{row['max_ms']:>12.2f}{row['errors']:>8}")
+        snapshot = self.snapshot()
+        for counter, value in sorted(snapshot['counters'].items()):
+            lines.append(f"{counter:<28}{value:>10}")
+        for (stage, kind), value in sorted(snapshot['errors'].items()):
+            lines.append(f"{'error ' + stage + '/' + kind:<28}{value:>10}")
+        return '\n'.join(lines)
+
+    def to_prometheus(self, prefix='predict'):
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_calls_total counter"]
+        lines += [f'{prefix}_stage_calls_total{{stage="{stage}"}} {calls}'
+                  for stage, (calls, _, _, _) in sorted(snapshot['stages'].items())]
+        lines.append(f"# TYPE {prefix}_stage_seconds_total counter")
+        for stage, (_, wall_total, cpu_total, _) in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}",clock="wall"}} {wall_total:.6f}')
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}",clock="cpu"}} {cpu_total:.6f}')
+        lines.append(f"# TYPE {prefix}_stage_max_seconds gauge")
+        lines += [f'{prefix}_stage_max_seconds{{stage="{stage}"}} {wall_max:.6f}'
+                  for stage, (_, _, _, wall_max) in sorted(snapshot['stages'].items())]
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        lines += [f'{prefix}_events_total{{event="{counter}"}} {value}'
+                  for counter, value in sorted(snapshot['counters'].items())]
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        lines += [f'{prefix}_errors_total{{stage="{stage}",kind="{kind}"}} {value}'
+                  for (stage, kind), value in sorted(snapshot['errors'].items())]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
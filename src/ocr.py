@@ -0,0 +1,400 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from metrics import metrics
+
+DEFAULT_LANGS = ('en',)
+
+
+class ReaderService:
+    """One warm EasyOCR reader per process, created on first use."""
+
+    def __init__(self, langs=DEFAULT_LANGS, gpu=True):
+        self.langs = list(langs)
+        self.gpu = gpu
+        self._reader = None
+        self._lock = threading.Lock()
+        self.load_time = 0.0
+        self.inference_time = 0.0
+        self.images = 0
+        self.boxes = 0
+        self.boxes_skipped = 0
+        self.numeric_fallbacks = 0
+
+    @property
+    def config(self):
+        return {'langs': self.langs, 'gpu': self.gpu}
+
+    @property
+    def reader(self):
+        """Return the reader, loading the detection and recognition weights once."""
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    # Imported on first use, so importing this module does not load torch
+                    import easyocr
+
+                    start = time.perf_counter()
+                    self._reader = easyocr.Reader(self.langs, gpu=self.gpu)
+                    self.load_time = time.perf_counter() - start
+                    metrics.observe('reader_init', self.load_time)
+        return self._reader
+
+    def readtext(self, image_rgb, **kwargs):
+        """Run EasyOCR on an RGB image and record the inference time."""
+        reader = self.reader
+        start = time.perf_counter()
+        result = reader.readtext(image_rgb, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.inference_time += elapsed
+            self.images += 1
+        return result
+
+    def readtext_numeric(self, image_rgb, regions, **kwargs):
+        """OCR only the text boxes that can hold a measurement.
+
+        Detection runs on the whole image, `regions` (a NumericRegions) picks
+        the candidate boxes, and only those are recognised, restricted to its
+        allowlist. Without a candidate holding a digit the image gets a full
+        `readtext(image_rgb, **kwargs)` instead.
+        """
+        reader = self.reader
+        start = time.perf_counter()
+        horizontal_list, free_list = reader.detect(image_rgb)
+        horizontal_list, free_list = horizontal_list[0], free_list[0]
+        horizontal_keep, free_keep = regions.screen(horizontal_list, free_list)
+        skipped = len(horizontal_list) + len(free_list) - len(horizontal_keep) - len(free_keep)
+        result = []
+        if horizontal_keep or free_keep:
+            result = regions.keep(reader.recognize(image_rgb, horizontal_keep, free_keep, allowlist=regions.allowlist))
+        fallback = not result
+        if fallback:
+            result = reader.readtext(image_rgb, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.inference_time += elapsed
+            self.images += 1
+            self.boxes += len(horizontal_list) + len(free_list)
+            self.boxes_skipped += skipped
+            self.numeric_fallbacks += fallback
+        return result
+
+    def readtext_batched(self, images, batch_size=8, size_step=64, **kwargs):
+        """OCR many images with batched detection and recognition.
+
+        Images are grouped into buckets of similar size (each side rounded to
+        `size_step` pixels). Every bucket is resized to its common size and
+        passed to EasyOCR's `readtext_batched` up to `batch_size` images at a
+        time. Boxes are scaled back to each image's own coordinates, and
+        results come back in input order.
+        """
+        reader = self.reader
+        results = [None] * len(images)
+        start = time.perf_counter()
+        for (height, width), positions in size_buckets(images, size_step).items():
+            for offset in range(0, len(positions), batch_size):
+                chunk = positions[offset:offset + batch_size]
+                batch_results = reader.readtext_batched(
+                    [images[i] for i in chunk], n_width=width, n_height=height, batch_size=batch_size, **kwargs)
+                for i, result in zip(chunk, batch_results):
+                    image_height, image_width = images[i].shape[:2]
+                    results[i] = _rescale(result, image_width / width, image_height / height)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.inference_time += elapsed
+            self.images += len(images)
+        return results
+
+    def stats(self):
+        """Return model-load time separately from per-image inference time."""
+        return {
+            'load_time': self.load_time,
+            'inference_time': self.inference_time,
+            'images': self.images,
+            'mean_inference_time': self.inference_time / self.images if self.images else 0.0,
+            **self.region_counts(),
+        }
+
+    def region_counts(self):
+        """Boxes detected and skipped by the numeric-region mode, and images that fell back to full OCR."""
+        return {'boxes': self.boxes, 'boxes_skipped': self.boxes_skipped, 'numeric_fallbacks': self.numeric_fallbacks}
+
+
+class NumericRegions:
+    """Settings of the numeric-region fast path of `ReaderService.readtext_numeric`.
+
+    Detected boxes are screened by geometry before recognition: boxes lower
+    than `min_height` pixels, or with a width/height ratio outside
+    `[min_aspect, max_aspect]` (specks, rules, whole paragraphs), are skipped.
+    Candidates are recognised with `allowlist` only, and afterwards screened
+    by character set: a box is kept if its text holds a digit, or if it
+    directly follows such a box on the same line (a unit printed apart from
+    its number).
+    """
+
+    def __init__(self, allowlist, min_height=8, min_aspect=0.3, max_aspect=25.0):
+        self.allowlist = allowlist
+        self.min_height = min_height
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+
+    def config(self):
+        return {'allowlist': self.allowlist, 'min_height': self.min_height, 'min_aspect': self.min_aspect,
+                'max_aspect': self.max_aspect}
+
+    def __repr__(self):
+        return 'NumericRegions({})'.format(', '.join(f'{key}={value!r}' for key, value in self.config().items()))
+
+    def _fits(self, width, height):
+        return height >= self.min_height and self.min_aspect <= width / height <= self.max_aspect
+
+    def screen(self, horizontal_list, free_list):
+        """Return the horizontal ([x_min, x_max, y_min, y_max]) and free (four corners) boxes worth recognising."""
+        horizontal = [box for box in horizontal_list if self._fits(box[1] - box[0], box[3] - box[2])]
+        free = []
+        for box in free_list:
+            xs, ys = [x for x, _ in box], [y for _, y in box]
+            if self._fits(max(xs) - min(xs), max(ys) - min(ys)):
+                free.append(box)
+        return horizontal, free
+
+    def keep(self, result):
+        """Drop recognised boxes that cannot be part of a measurement."""
+        kept = []
+        previous = None
+        for item in result:
+            box, text, _ = item
+            ys = [y for _, y in box]
+            if any(char.isdigit() for char in text):
+                kept.append(item)
+                previous = (min(ys), max(ys))
+                continue
+            # A unit box on the line of the number before it
+            if previous is not None and min(ys) < previous[1] and max(ys) > previous[0]:
+                kept.append(item)
+            previous = None
+        return kept
+
+
+def size_buckets(images, size_step=64):
+    """Group image positions by (height, width) rounded to `size_step` pixels."""
+    buckets = {}
+    for position, image in enumerate(images):
+        height, width = image.shape[:2]
+        key = (max(1, round(height / size_step)) * size_step, max(1, round(width / size_step)) * size_step)
+        buckets.setdefault(key, []).append(position)
+    return buckets
+
+
+def _rescale(result, scale_x, scale_y):
+    return [
+        ([[int(round(x * scale_x)), int(round(y * scale_y))] for x, y in box], text, confidence)
+        for box, text, confidence in result
+    ]
+
+
+def decode_image(data, preprocessor=None):
+    """Decode encoded image bytes into an RGB array as EasyOCR expects.
+
+    A `preprocess.Preprocessor` takes over decoding and shrinks the image first.
+    """
+    if preprocessor is not None:
+        return preprocessor(data)
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image data")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_reader_service(langs=DEFAULT_LANGS, gpu=True):
+    """Return the process-wide reader service for the given configuration."""
+    key = (tuple(langs), gpu)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = ReaderService(langs, gpu)
+            _services[key] = service
+    return service
+
+
+def _warm_worker(langs, gpu, threads):
+    import torch
+
+    # Each worker gets its share of the cores instead of every process using all of them
+    torch.set_num_threads(threads)
+    get_reader_service(langs, gpu).reader
+
+
+def _worker_readtext(image, langs, gpu, kwargs, preprocessor, regions=None):
+    service = get_reader_service(langs, gpu)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        with metrics.stage('decode'):
+            image = decode_image(image, preprocessor)
+    start = time.perf_counter()
+    with metrics.stage('ocr'):
+        if regions is not None:
+            result = service.readtext_numeric(image, regions, **kwargs)
+        else:
+            result = service.readtext(image, **kwargs)
+    # The parent merges what this worker recorded (reader init, decode, OCR) into its own metrics
+    return (os.getpid(), service.load_time, time.perf_counter() - start, service.region_counts(), metrics.drain(),
+            result)
+
+
+def _worker_readtext_batched(images, langs, gpu, kwargs, preprocessor, batch_size, regions=None):
+    service = get_reader_service(langs, gpu)
+    outcomes = [None] * len(images)
+    decoded = {}
+    for position, image in enumerate(images):
+        try:
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                with metrics.stage('decode'):
+                    image = decode_image(image, preprocessor)
+            decoded[position] = image
+        except Exception as e:
+            outcomes[position] = e
+    start = time.perf_counter()
+    if decoded:
+        with metrics.stage('ocr'):
+            _readtext_decoded(service, decoded, outcomes, kwargs, batch_size, regions)
+    return (os.getpid(), service.load_time, time.perf_counter() - start, service.region_counts(), metrics.drain(),
+            outcomes)
+
+
+def _readtext_decoded(service, decoded, outcomes, kwargs, batch_size, regions):
+    # Fills `outcomes` at the positions of the `decoded` images
+    if regions is not None:
+        # Each image needs its own detection pass to pick boxes, so the numeric path is not batched
+        for i, image in decoded.items():
+            try:
+                outcomes[i] = service.readtext_numeric(image, regions, **kwargs)
+            except Exception as e:
+                outcomes[i] = e
+    else:
+        positions = list(decoded)
+        try:
+            results = service.readtext_batched([decoded[i] for i in positions], batch_size, **kwargs)
+        except Exception:
+            # One bad image should not fail its whole batch, so fall back to per-image OCR
+            results = []
+            for i in positions:
+                try:
+                    results.append(service.readtext(decoded[i], **kwargs))
+                except Exception as e:
+                    results.append(e)
+        for i, result in zip(positions, results):
+            outcomes[i] = result
+
+
+class OCRPool:
+    """A pool of CPU worker processes, each holding its own warm reader."""
+
+    def __init__(self, workers=None, langs=DEFAULT_LANGS, gpu=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.langs = tuple(langs)
+        self.gpu = gpu
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_worker, initargs=(self.langs, self.gpu, threads))
+        self._lock = threading.Lock()
+        self.load_times = {}
+        self.inference_time = 0.0
+        self.images = 0
+        self.region_counts = {}
+
+    def submit(self, image, preprocessor=None, regions=None, **kwargs):
+        """Queue an RGB array, or encoded image bytes decoded in the worker, for OCR.
+
+        The returned future resolves to the `readtext` result. With a
+        NumericRegions, only candidate measurement boxes are recognised.
+        """
+        future = self._executor.submit(_worker_readtext, image, self.langs, self.gpu, kwargs, preprocessor, regions)
+        return _unwrap(future, self._record)
+
+    def readtext(self, image, preprocessor=None, regions=None, **kwargs):
+        return self.submit(image, preprocessor, regions, **kwargs).result()
+
+    def submit_batch(self, images, preprocessor=None, batch_size=8, regions=None, **kwargs):
+        """Queue a list of images for batched OCR in one worker.
+
+        The future resolves to a list with, per image, its `readtext` result
+        or the exception raised while decoding or recognising it.
+        """
+        future = self._executor.submit(
+            _worker_readtext_batched, images, self.langs, self.gpu, kwargs, preprocessor, batch_size, regions)
+        return _unwrap(future, lambda *meta: self._record(*meta, count=len(images)))
+
+    def _record(self, pid, load_time, elapsed, region_counts, snapshot, count=1):
+        metrics.merge(snapshot)
+        with self._lock:
+            self.load_times[pid] = load_time
+            # Counts are cumulative per worker, so the latest report of each worker is kept
+            self.region_counts[pid] = region_counts
+            self.inference_time += elapsed
+            self.images += count
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'load_time': sum(self.load_times.values()),
+                'inference_time': self.inference_time,
+                'images': self.images,
+                'mean_inference_time': self.inference_time / self.images if self.images else 0.0,
+                **{key: sum(counts[key] for counts in self.region_counts.values())
+                   for key in ('boxes', 'boxes_skipped', 'numeric_fallbacks')},
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+_pools = {}
+
+
+def get_ocr_pool(workers=None, langs=DEFAULT_LANGS, gpu=False):
+    """Return the process-wide OCR pool with the given width, starting it on first use."""
+    # None means all cores, so callers asking for the default and for os.cpu_count() share one pool
+    key = (workers or os.cpu_count() or 1, tuple(langs), gpu)
+    with _services_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = OCRPool(workers, langs, gpu)
+            _pools[key] = pool
+    return pool
+
+
+def _unwrap(future, record):
+    """Chain a worker future into one that yields only the OCR result."""
+    outer = Future()
+
+    def done(inner):
+        try:
+            *meta, result = inner.result()
+        except BaseException as e:
+            outer.set_exception(e)
+            return
+        record(*meta)
+        outer.set_result(result)
+
+    future.add_done_callback(done)
+    return outer
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from importlib import metadata
+
+from db import local_connection
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'OCR_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.ocr_cache', 'ocr_cache.sqlite3'))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# A hit only rewrites `last_used` once it is older than this many seconds, so reads rarely take the write lock
+TOUCH_AFTER = 60.0
+
+
+def content_hash(data):
+    """Return a short hex digest identifying the encoded image bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def reader_config_key(langs=('en',), preprocessor=None, regions=None, batch_size=1, size_step=64,
+                      **readtext_kwargs):
+    """Digest of everything besides the image that changes the OCR output.
+
+    With `batch_size` > 1 images are OCR'd by `ReaderService.readtext_batched`,
+    which resizes them to multiples of `size_step`, so batched and one-by-one
+    results are cached apart. Numeric regions are always OCR'd one image at a time.
+    """
+    config = {'langs': sorted(langs), 'readtext': readtext_kwargs}
+    if preprocessor is not None:
+        config['preprocess'] = preprocessor.config()
+    if regions is not None:
+        config['numeric_regions'] = regions.config()
+    elif batch_size > 1:
+        config['batched'] = {'size_step': size_step}
+    try:
+        config['easyocr'] = metadata.version('easyocr')
+    except metadata.PackageNotFoundError:
+        pass
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def _encode_result(result):
+    # readtext returns numpy ints/floats in the boxes and confidences, which json cannot serialise
+    return json.dumps([
+        [[[int(x), int(y)] for x, y in box], text, float(confidence)]
+        for box, text, confidence in result
+    ])
+
+
+def _decode_result(payload):
+    return [(box, text, confidence) for box, text, confidence in json.loads(payload)]
+
+
+class OCRCache:
+    """On-disk cache of full `readtext` results keyed by image content hash and reader config.
+
+    Entries live in a SQLite database in WAL mode, so several worker processes
+    can read and write it concurrently. Once the stored results exceed
+    `max_bytes`, the least recently used entries are evicted; recency is
+    tracked to within `TOUCH_AFTER` seconds.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, config_key=None, evict_every=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.config_key = config_key or reader_config_key()
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ocr_cache ('
+                'key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache (last_used)')
+
+    def _connection(self):
+        return local_connection(self._local, self.path)
+
+    def _key(self, digest):
+        return f"{digest}:{self.config_key}"
+
+    def get(self, digest):
+        """Return the cached `readtext` result for an image hash, or None."""
+        conn = self._connection()
+        key = self._key(digest)
+        row = conn.execute('SELECT result, last_used FROM ocr_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > TOUCH_AFTER:
+            conn.execute('UPDATE ocr_cache SET last_used = ? WHERE key = ?', (now, key))
+        return _decode_result(row[0])
+
+    def put(self, digest, result):
+        payload = _encode_result(result)
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO ocr_cache (key, result, size, last_used) VALUES (?, ?, ?, ?)',
+            (self._key(digest), payload, len(payload), time.time()))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in `max_bytes`."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM ocr_cache WHERE key IN ('
+                ' SELECT key FROM ('
+                '  SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS running FROM ocr_cache)'
+                ' WHERE running > ?)', (self.max_bytes,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def readtext(self, data, reader_service, preprocessor=None, **kwargs):
+        """OCR encoded image bytes through the cache, running the reader only on a miss.
+
+        The cache's `config_key` must cover `preprocessor`, see `reader_config_key`.
+        """
+        # Imported here so the cache can be used without loading torch
+        from ocr import decode_image
+
+        digest = content_hash(data)
+        result = self.get(digest)
+        if result is None:
+            result = reader_service.readtext(decode_image(data, preprocessor), **kwargs)
+            self.put(digest, result)
+        return result
+
+    def readtext_file(self, image_path, reader_service, preprocessor=None, **kwargs):
+        """OCR an image downloaded by `utils.download_images` through the cache."""
+        with open(image_path, 'rb') as f:
+            return self.readtext(f.read(), reader_service, preprocessor, **kwargs)
+
+    def stats(self):
+        conn = self._connection()
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_ocr_cache(path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, config_key=None):
+    """Return the process-wide cache for `path` and reader configuration."""
+    config_key = config_key or reader_config_key()
+    with _caches_lock:
+        cache = _caches.get((path, config_key))
+        if cache is None:
+            cache = OCRCache(path, max_bytes, config_key)
+            _caches[(path, config_key)] = cache
+    return cache
@@ -0,0 +1,361 @@
+import time
+import http.client
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+import requests
+import urllib3
+
+from metrics import metrics
+from ocr import get_ocr_pool
+from ocr_cache import content_hash
+
+_local = threading.local()
+
+
+def _session():
+    # requests.Session is not thread-safe, so each download thread keeps its own pooled session
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def group_by_image(image_links):
+    """Map each distinct image link to the positions of the rows that use it.
+
+    Links that are not strings (missing values) are grouped under None.
+    """
+    groups = OrderedDict()
+    for position, image_link in enumerate(image_links):
+        key = image_link if isinstance(image_link, str) else None
+        groups.setdefault(key, []).append(position)
+    return groups
+
+
+def fetch_image_bytes(image_link, timeout=30):
+    """Download an image and return the raw encoded bytes."""
+    response = _session().get(image_link, timeout=timeout)
+    if response.status_code != 200:
+        raise Exception(f"Failed to download image from {image_link}, Status Code: {response.status_code}")
+    return response.content
+
+
+MissingImage = namedtuple('MissingImage', ['url', 'status', 'error'])
+MissingImage.__doc__ = """An image that could not be fetched ('invalid' link, 'failed' download) or decoded ('undecodable')."""
+
+
+class ImageBuffer:
+    """A byte buffer that one thread reuses for every download.
+
+    `fill` reads with the stream's `readinto`, so the body of a download is
+    kept in the buffer instead of in a new bytes object per image, once the
+    buffer has grown to the largest image seen.
+    A view returned by `fill` is only valid until the next `fill`.
+    """
+
+    def __init__(self, size=256 * 1024):
+        self._data = bytearray(size)
+
+    def fill(self, stream, size_hint=None):
+        """Read `stream` to the end and return a memoryview of the bytes read."""
+        if size_hint and size_hint >= len(self._data):
+            # One spare byte, so reading to the end does not trigger a grow
+            self._data = bytearray(size_hint + 1)
+        view = memoryview(self._data)
+        size = 0
+        while True:
+            if size == len(view):
+                # Views of the old buffer may still be held, so grow into a new one instead of resizing
+                grown = bytearray(2 * len(view))
+                grown[:size] = view
+                self._data = grown
+                view = memoryview(grown)
+            read = stream.readinto(view[size:])
+            if not read:
+                return view[:size]
+            size += read
+
+
+def _buffer():
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = ImageBuffer()
+    return buffer
+
+
+def fetch_image(image_link, timeout=30, retries=3, backoff=0.5, buffer=None):
+    """Download an image into a reusable buffer.
+
+    Returns a memoryview of the encoded bytes, valid until the thread's next
+    download (or the next use of `buffer`), or a MissingImage when the link
+    is not a string or every attempt failed.
+    """
+    if not isinstance(image_link, str):
+        metrics.increment('missing_invalid')
+        return MissingImage(image_link, 'invalid', 'image link is not a string')
+    buffer = buffer or _buffer()
+    error = None
+    for attempt in range(max(1, retries)):
+        if attempt:
+            metrics.increment('retries')
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            with _session().get(image_link, timeout=timeout, stream=True) as response:
+                if response.status_code != 200:
+                    error = f"HTTP {response.status_code}"
+                    # Client errors will not go away on retry
+                    if 400 <= response.status_code < 500 and response.status_code != 429:
+                        break
+                    continue
+                size_hint = response.headers.get('Content-Length')
+                size_hint = int(size_hint) if size_hint and size_hint.isdigit() else None
+                raw = response.raw
+                # Read through urllib3 rather than the http.client response under it: urllib3 checks
+                # the body against Content-Length and raises on a truncated or broken chunked body
+                raw.decode_content = True
+                data = buffer.fill(raw, size_hint)
+        except (requests.RequestException, urllib3.exceptions.HTTPError, http.client.HTTPException, OSError) as e:
+            error = f"{type(e).__name__}: {e}"
+            continue
+        return data
+    metrics.increment('missing_failed')
+    return MissingImage(image_link, 'failed', error)
+
+
+class PipelineResult(namedtuple('PipelineResult', ['position', 'image_link', 'ocr_result', 'error', 'content_hash',
+                                                   'missing'], defaults=(None,))):
+    """OCR output of one image; `missing` is the MissingImage of a link that could not be fetched."""
+
+    @property
+    def text(self):
+        if self.ocr_result is None:
+            return None
+        return ' '.join([item[1] for item in self.ocr_result])
+
+
+class StagedPipeline:
+    """Overlaps image downloads (thread pool) with decode and OCR (process pool).
+
+    At most `max_pending` images are in flight between the two stages, so a slow
+    OCR stage holds back new downloads instead of buffering the whole input.
+    Results are yielded in input order.
+
+    Images whose bytes hash to a digest seen among the last `hash_window`
+    downloads share a single OCR run. With an OCRCache, results from earlier
+    runs are reused and new ones are stored. A `preprocess.Preprocessor` is
+    applied in the OCR workers between decode and recognition; the cache's
+    config key must include it.
+
+    Images are sent to the OCR workers in batches of `ocr_batch_size` for
+    batched detection and recognition. A partial batch is sent once a worker
+    would otherwise sit idle. `ocr_batch_size=1` submits images one by one.
+
+    With `regions` (an `ocr.NumericRegions`), only the text boxes that can
+    hold a measurement are recognised. With an `image_store.ImageStore`,
+    images already in the store are read from it instead of downloaded, and
+    new downloads are added to it `store_batch_size` at a time.
+    """
+
+    def __init__(self, download_workers=16, ocr_workers=None, max_pending=None, ocr_pool=None, timeout=30,
+                 hash_window=4096, cache=None, preprocessor=None, ocr_batch_size=8,
+                 regions=None, store=None, store_batch_size=64):
+        self.download_workers = download_workers
+        self.ocr_pool = ocr_pool or get_ocr_pool(ocr_workers)
+        self.max_pending = max_pending or 2 * (download_workers + self.ocr_pool.workers)
+        self.timeout = timeout
+        self.hash_window = hash_window
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.ocr_batch_size = ocr_batch_size
+        self.regions = regions
+        self.store = store
+        self.store_batch_size = store_batch_size
+        self._store_batch = []
+        self._by_hash = OrderedDict()
+        # Reentrant: a batch that is already done runs _batch_done as soon as _submit_batch adds the callback
+        self._lock = threading.RLock()
+        self._batch = []
+        self._inflight_batches = 0
+        self.rows = 0
+        self.downloads = 0
+        self.ocr_runs = 0
+        self.cache_hits = 0
+        self.store_hits = 0
+
+    def _ocr_once(self, data):
+        digest = content_hash(data)
+        with self._lock:
+            self.downloads += 1
+            ocr_future = self._by_hash.get(digest)
+            if ocr_future is not None:
+                self._by_hash.move_to_end(digest)
+                return digest, ocr_future
+            cached = self.cache.get(digest) if self.cache is not None else None
+            if cached is not None:
+                self.cache_hits += 1
+                metrics.increment('cache_hits')
+                ocr_future = Future()
+                ocr_future.set_result(cached)
+            else:
+                if self.ocr_batch_size > 1:
+                    ocr_future = Future()
+                    self._batch.append((data, ocr_future))
+                    if len(self._batch) >= self.ocr_batch_size:
+                        self._submit_batch()
+                else:
+                    ocr_future = self.ocr_pool.submit(data, self.preprocessor, self.regions)
+                self.ocr_runs += 1
+                if self.cache is not None:
+                    ocr_future.add_done_callback(lambda f: self._store(digest, f))
+            self._by_hash[digest] = ocr_future
+            if len(self._by_hash) > self.hash_window:
+                self._by_hash.popitem(last=False)
+        return digest, ocr_future
+
+    def _submit_batch(self):
+        # Called with self._lock held
+        batch, self._batch = self._batch, []
+        self._inflight_batches += 1
+        images = [data for data, _ in batch]
+        try:
+            batch_future = self.ocr_pool.submit_batch(images, self.preprocessor, self.ocr_batch_size, self.regions)
+        except Exception as e:
+            # e.g. BrokenProcessPool: fail the batch's rows instead of leaving _finish waiting on them
+            self._inflight_batches -= 1
+            for _, ocr_future in batch:
+                ocr_future.set_exception(e)
+            return
+        batch_future.add_done_callback(lambda f: self._batch_done(batch, f))
+
+    def _batch_done(self, batch, batch_future):
+        with self._lock:
+            self._inflight_batches -= 1
+        try:
+            outcomes = batch_future.result()
+        except Exception as e:
+            outcomes = [e] * len(batch)
+        for (_, ocr_future), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                ocr_future.set_exception(outcome)
+            else:
+                ocr_future.set_result(outcome)
+
+    def _flush_if_idle(self):
+        with self._lock:
+            if self._batch and self._inflight_batches < self.ocr_pool.workers:
+                self._submit_batch()
+
+    def _store(self, digest, future):
+        if future.exception() is None:
+            self.cache.put(digest, future.result())
+
+    def _fetch(self, image_link):
+        if self.store is not None:
+            data = self.store.get(image_link)
+            if data is not None:
+                with self._lock:
+                    self.store_hits += 1
+                metrics.increment('store_hits')
+                # The OCR workers get a pickled copy either way
+                return bytes(data)
+        with metrics.stage('download'):
+            data = fetch_image(image_link, self.timeout)
+        if isinstance(data, MissingImage):
+            return data
+        # The view is only valid until this thread's next download
+        data = bytes(data)
+        if self.store is not None:
+            self._add_to_store(image_link, data)
+        return data
+
+    def _add_to_store(self, image_link, data):
+        # One store transaction and fsync per batch, so downloads do not queue on the store's lock
+        with self._lock:
+            self._store_batch.append((image_link, data))
+            if len(self._store_batch) < self.store_batch_size:
+                return
+            batch, self._store_batch = self._store_batch, []
+        self.store.put_many(batch)
+
+    def _flush_store(self):
+        with self._lock:
+            batch, self._store_batch = self._store_batch, []
+        if batch:
+            self.store.put_many(batch)
+
+    def _submit(self, downloads, image_link):
+        result = Future()
+
+        def downloaded(future):
+            try:
+                data = future.result()
+                if isinstance(data, MissingImage):
+                    result.set_result((None, data))
+                    return
+                digest, ocr_future = self._ocr_once(data)
+            except Exception as e:
+                result.set_exception(e)
+                return
+            ocr_future.add_done_callback(lambda f: recognized(digest, f))
+
+        def recognized(digest, future):
+            try:
+                result.set_result((digest, future.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        downloads.submit(self._fetch, image_link).add_done_callback(downloaded)
+        return result
+
+    def _finish(self, position, image_link, future):
+        while True:
+            try:
+                digest, ocr_result = future.result(timeout=0.05)
+                if isinstance(ocr_result, MissingImage):
+                    return PipelineResult(position, image_link, None, None, None, ocr_result)
+                return PipelineResult(position, image_link, ocr_result, None, digest)
+            except TimeoutError:
+                # The awaited image may sit in a partial batch; send it if a worker is free
+                self._flush_if_idle()
+            except Exception as e:
+                return PipelineResult(position, image_link, None, e, None)
+
+    def run(self, image_links):
+        """Yield a PipelineResult for every link, in the order the links were given."""
+        try:
+            with ThreadPoolExecutor(max_workers=self.download_workers) as downloads:
+                pending = deque()
+                for position, image_link in enumerate(image_links):
+                    if len(pending) >= self.max_pending:
+                        yield self._finish(*pending.popleft())
+                    pending.append((position, image_link, self._submit(downloads, image_link)))
+                while pending:
+                    yield self._finish(*pending.popleft())
+        finally:
+            if self.store is not None:
+                self._flush_store()
+
+    def run_rows(self, image_links):
+        """Download and OCR each distinct link once.
+
+        Yields `(positions, result)` pairs, where `positions` are the rows
+        sharing the image, so every entity requested for it can be answered
+        from the same OCR text.
+        """
+        groups = group_by_image(image_links)
+        self.rows += len(image_links)
+        for item in self.run(list(groups)):
+            yield groups[item.image_link], item
+
+    def dedup_stats(self):
+        """Report how much OCR work the URL and content-hash dedup saved."""
+        return {
+            'rows': self.rows,
+            'downloads': self.downloads,
+            'ocr_runs': self.ocr_runs,
+            'cache_hits': self.cache_hits,
+            'store_hits': self.store_hits,
+            'dedup_ratio': self.rows / self.ocr_runs if self.ocr_runs else 0.0,
+        }
@@ -0,0 +1,479 @@
+import os
+import re
+import csv
+import hashlib
+import argparse
+from pathlib import Path
+import cv2
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from batch_extract import predict_frame
+from columnar import FrameWriter, OCRTextWriter, export_csv, is_parquet, iter_frames, prediction_schema, read_ocr_results, read_ocr_texts
+from image_store import ImageStore
+from metrics import metrics
+from ocr import NumericRegions, get_reader_service
+from ocr_cache import content_hash, get_ocr_cache, reader_config_key
+from pipeline import MissingImage, StagedPipeline, fetch_image
+from ranking import CandidateRanker
+from preprocess import Preprocessor
+from sanity import sanity_check
+from units import allowed_units, format_match, unit_matcher
+from utils import common_mistake
+
+
+# The number part sanity.py's parse_string accepts
+PREDICTION_VALUE = re.compile(r'^\d+(\.\d+)?$')
+
+
+def extract_values_with_units(text):
+    return [format_match(match) for match in unit_matcher.finditer(text)]
+
+def get_value_for_entity(entity_name, text):
+    match = unit_matcher.first_for_entity(text, entity_name)
+    return [format_match(match)] if match else []
+
+
+class ImageProcessingPipeline:
+    def __init__(self, image_url, regions=None):
+        self.image_url = image_url
+        self.regions = regions
+        self.image = None
+        self.image_hash = None
+        self.ocr_result = None
+        self.extracted_text = None
+        self.missing = None
+    
+    def download_image(self):
+        """Download the image into this thread's reusable buffer and decode it from there.
+
+        Returns a MissingImage (also kept in `self.missing`) when the image
+        cannot be fetched or decoded, so the caller can skip OCR.
+        """
+        with metrics.stage('download'):
+            data = fetch_image(self.image_url)
+        if isinstance(data, MissingImage):
+            self.missing = data
+            return data
+        with metrics.stage('decode'):
+            self.image_hash = content_hash(data)
+            # np.frombuffer wraps the buffer without copying it
+            self.image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if self.image is None:
+            metrics.increment('missing_undecodable')
+            self.missing = MissingImage(self.image_url, 'undecodable', 'Could not decode image data')
+        return self.missing
+    
+    def extract_text(self):
+        """Extract text from the image using EasyOCR."""
+        if self.image is None:
+            raise FileNotFoundError("Image is not downloaded.")
+        
+        # Reuse the OCR output of an identical image from an earlier run
+        cache = get_ocr_cache(config_key=reader_config_key(regions=self.regions))
+        result = cache.get(self.image_hash) if self.image_hash else None
+        metrics.increment('cache_hits' if result is not None else 'cache_misses')
+        if result is None:
+            # Convert the image to RGB as EasyOCR expects RGB input
+            image_rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+
+            # Load the weights outside the OCR timer so model load and inference are told apart
+            service = get_reader_service()
+            service.reader
+
+            # Perform OCR with the process-wide warm reader, on measurement boxes only when configured
+            with metrics.stage('ocr'):
+                if self.regions is not None:
+                    result = service.readtext_numeric(image_rgb, self.regions)
+                else:
+                    result = service.readtext(image_rgb)
+            if self.image_hash:
+                cache.put(self.image_hash, result)
+        if not result:
+            metrics.increment('empty_ocr')
+        
+        # Extract the text from the result
+        self.ocr_result = result
+        self.extracted_text = ' '.join([text[1] for text in result])
+    
+    def get_extracted_text(self):
+        """Return the extracted text."""
+        if self.extracted_text is None:
+            raise RuntimeError("Text extraction not performed.")
+        return self.extracted_text
+
+# Dummy implementation for the predictor function
+# Replace it with your actual implementation
+def predictor(image_link, entity_name, ranker=None, regions=None):
+    '''
+    Call your model/approach here
+    '''
+    metrics.increment('rows')
+    try:
+        pipeline = ImageProcessingPipeline(image_link, regions)
+        missing = pipeline.download_image()
+        if missing is not None:
+            # Nothing to OCR, unlike the black placeholder images of download_images
+            print(f"Skipping {image_link}: {missing.status} ({missing.error})")
+            return None
+        pipeline.extract_text()
+        if ranker is not None:
+            with metrics.stage('rank'):
+                match = ranker.rank(pipeline.ocr_result, entity_name)
+            result = [format_match(match)] if match else []
+        else:
+            extracted_text = pipeline.get_extracted_text()
+            with metrics.stage('regex'):
+                result = get_value_for_entity(entity_name, extracted_text)
+        if not result:
+            metrics.increment('no_match')
+        return result[0] if result else None
+    except Exception as e:
+        # Counted once, under the stage it was raised in (or 'predictor')
+        metrics.record_error('predictor', e)
+        print(f"Error processing {image_link}: {e}")
+        return None
+
+
+def predict_rows(image_links, entity_names, pipeline, ranker=None, ocr_writer=None):
+    """Yield `(positions, predictions)` for each distinct image once its OCR finishes.
+
+    Every entity requested for an image is answered from the same OCR text,
+    by the first allowed match or, with a `ranking.CandidateRanker`, by the
+    best-scoring candidate. An `ocr_writer` (`columnar.OCRTextWriter`) is
+    given every OCR result, so the run can be re-scored later; images that
+    could not be fetched or OCR'd are given to it with a None result.
+    """
+    for positions, item in pipeline.run_rows(image_links):
+        metrics.increment('rows', len(positions))
+        if ocr_writer is not None and isinstance(item.image_link, str):
+            ocr_writer.add(item.image_link, item.content_hash, item.ocr_result)
+        if item.missing is not None:
+            print(f"Skipping {item.image_link}: {item.missing.status} ({item.missing.error})")
+            yield positions, [None] * len(positions)
+            continue
+        if item.error is not None:
+            metrics.record_error('pipeline', item.error)
+            print(f"Error processing {item.image_link}: {item.error}")
+            yield positions, [None] * len(positions)
+            continue
+        text = item.text
+        if not text:
+            metrics.increment('empty_ocr')
+        predictions = []
+        if ranker is not None:
+            with metrics.stage('rank'):
+                candidates = ranker.candidates(item.ocr_result)
+                for position in positions:
+                    match = ranker.best(candidates, entity_names[position])
+                    predictions.append(format_match(match) if match else None)
+        else:
+            with metrics.stage('regex'):
+                for position in positions:
+                    result = get_value_for_entity(entity_names[position], text)
+                    predictions.append(result[0] if result else None)
+        metrics.increment('no_match', predictions.count(None))
+        yield positions, predictions
+
+def format_prediction(prediction):
+    """Normalise a prediction to the `<float> <unit>` form sanity.py accepts, or '' when it cannot be."""
+    if not prediction:
+        return ''
+    value, unit = prediction.split(maxsplit=1)
+    unit = common_mistake(unit)
+    if unit not in allowed_units:
+        return ''
+    try:
+        # Positional, as repr() writes very small and very large values with an exponent sanity.py rejects
+        value = np.format_float_positional(float(value), trim='0')
+    except ValueError:
+        return ''
+    return f"{value} {unit}" if PREDICTION_VALUE.match(value) else ''
+
+def load_checkpoint(checkpoint_filename):
+    """Return {index: prediction} for the rows already in the checkpoint.
+
+    A last line left half-written by an interrupted run is cut off first.
+    """
+    if not os.path.exists(checkpoint_filename):
+        return {}
+    with open(checkpoint_filename, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+    with open(checkpoint_filename, newline='', encoding='utf-8') as f:
+        return {row['index']: row['prediction'] for row in csv.DictReader(f)}
+
+def parse_shard(spec):
+    """Parse a shard spec "k/N" (0 <= k < N) into (k, N)."""
+    try:
+        shard, num_shards = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard spec {spec!r}, expected k/N")
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Invalid shard spec {spec!r}, expected 0 <= k < N")
+    return shard, num_shards
+
+def shard_of(image_link, num_shards):
+    """Deterministically assign an image to a shard.
+
+    The key is the image file name, which is content-derived for the challenge
+    images, so duplicate rows land on the same shard and OCR dedup keeps working.
+    """
+    key = Path(image_link).name if isinstance(image_link, str) else ''
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+def _in_shard(chunk, shard):
+    if shard is None:
+        return chunk
+    k, num_shards = shard
+    return chunk[chunk['image_link'].map(lambda image_link: shard_of(image_link, num_shards) == k)]
+
+def _predict_chunk(chunk, pipeline, ranker=None, ocr_writer=None, regions=None):
+    image_links = chunk['image_link'].tolist()
+    entity_names = chunk['entity_name'].tolist()
+    if pipeline is None:
+        for position, (image_link, entity_name) in enumerate(zip(image_links, entity_names)):
+            yield [position], [predictor(image_link, entity_name, ranker, regions)]
+    else:
+        yield from predict_rows(image_links, entity_names, pipeline, ranker, ocr_writer)
+
+def _flush(f, ocr_writer=None):
+    # OCR rows are committed first, so a checkpointed row has its OCR text
+    if ocr_writer is not None:
+        ocr_writer.flush()
+    f.flush()
+    os.fsync(f.fileno())
+
+def _backfill_ocr_texts(pipeline, ocr_writer, image_links):
+    """Add images of checkpointed rows whose OCR text an earlier run did not keep.
+
+    They are fetched again (or read from the image store), and their OCR
+    comes from the OCR cache where the earlier run left it.
+    """
+    print(f"Adding {len(image_links)} images of checkpointed rows to the OCR-text table")
+    for _, item in pipeline.run_rows(image_links):
+        ocr_writer.add(item.image_link, item.content_hash, item.ocr_result)
+    ocr_writer.flush()
+
+def run_batch(input_filename, output_filename, checkpoint_filename=None, chunk_size=1000, flush_every=100,
+              download_workers=16, ocr_workers=None, sequential=False, shard=None, preprocessor=None,
+              ocr_batch_size=8, regions=None, image_store=None, ranker=None, ocr_text_filename=None):
+    """Predict every row of `input_filename`, resuming from the checkpoint of an earlier run.
+
+    Predictions are appended to the checkpoint and flushed every `flush_every`
+    rows. Once all rows are done, `output_filename` is written in input order.
+    With `shard=(k, N)` only the rows of shard k are predicted and written.
+    A `preprocessor` shrinks images before OCR in the staged pipeline, which
+    sends them to the OCR workers `ocr_batch_size` at a time. With `regions`
+    (an `ocr.NumericRegions`) only boxes that can hold a measurement are
+    recognised. Images are read from and added to `image_store` (an
+    `image_store.ImageStore`) when given. A `ranking.CandidateRanker` picks
+    the best-scoring value instead of the first allowed one.
+
+    `input_filename` and `output_filename` may be CSV or Parquet. With
+    `ocr_text_filename`, the OCR output of the staged pipeline is kept in a
+    Parquet table for `rescore`, committed with each checkpoint flush. On
+    resume, images of checkpointed rows missing from the table are added.
+
+    With `sequential=True` rows go through `predictor` one at a time, which
+    honours `ranker` and `regions`; the other staged-only options raise
+    ValueError rather than being ignored.
+    """
+    if sequential:
+        staged_only = {'preprocessor': preprocessor, 'image_store': image_store, 'ocr_text_filename': ocr_text_filename}
+        unsupported = [name for name, value in staged_only.items() if value is not None]
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} need the staged pipeline and cannot be used with sequential=True")
+    checkpoint_filename = checkpoint_filename or output_filename + '.checkpoint'
+    done = set(load_checkpoint(checkpoint_filename))
+    if done:
+        print(f"Resuming: {len(done)} rows already in {checkpoint_filename}")
+
+    pipeline = None
+    ocr_writer = None
+    if not sequential:
+        cache = get_ocr_cache(config_key=reader_config_key(preprocessor=preprocessor, regions=regions,
+                                                             batch_size=ocr_batch_size))
+        pipeline = StagedPipeline(download_workers=download_workers, ocr_workers=ocr_workers, cache=cache,
+                                  preprocessor=preprocessor, ocr_batch_size=ocr_batch_size,
+                                  regions=regions, store=image_store)
+        if ocr_text_filename:
+            ocr_writer = OCRTextWriter(ocr_text_filename)
+
+    try:
+        backfill = set()
+        with open(checkpoint_filename, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(['index', 'prediction'])
+            pending = 0
+            progress = tqdm(unit='rows', initial=len(done))
+            for chunk in iter_frames(input_filename, ['index', 'image_link', 'entity_name'], chunk_size):
+                checkpointed = chunk['index'].astype(str).isin(done)
+                if ocr_writer is not None and checkpointed.any():
+                    backfill.update(image_link for image_link in _in_shard(chunk[checkpointed], shard)['image_link']
+                                    if isinstance(image_link, str) and image_link not in ocr_writer)
+                chunk = _in_shard(chunk[~checkpointed], shard)
+                if chunk.empty:
+                    continue
+                indices = chunk['index'].astype(str).tolist()
+                for positions, predictions in _predict_chunk(chunk, pipeline, ranker, ocr_writer, regions):
+                    for position, prediction in zip(positions, predictions):
+                        writer.writerow([indices[position], format_prediction(prediction)])
+                    pending += len(positions)
+                    progress.update(len(positions))
+                    if pending >= flush_every:
+                        _flush(f, ocr_writer)
+                        pending = 0
+            _flush(f, ocr_writer)
+            progress.close()
+        # Images shared with rows of this run were added meanwhile
+        backfill = [image_link for image_link in backfill if image_link not in ocr_writer]
+        if backfill:
+            _backfill_ocr_texts(pipeline, ocr_writer, backfill)
+    finally:
+        # Also on an interrupt, so the committed OCR rows end up in the table
+        if ocr_writer is not None:
+            ocr_writer.close()
+
+    if pipeline is not None:
+        print(pipeline.dedup_stats())
+        if regions is not None:
+            stats = pipeline.ocr_pool.stats()
+            print(f"Numeric regions: skipped {stats['boxes_skipped']} of {stats['boxes']} boxes, "
+                  f"{stats['numeric_fallbacks']} images fell back to full OCR")
+    print(metrics.summary_table())
+    write_output(input_filename, load_checkpoint(checkpoint_filename), output_filename, chunk_size, shard)
+
+def write_output(input_filename, predictions, output_filename, chunk_size=1000, shard=None):
+    """Write the `index,prediction` file (CSV or Parquet) in input order from {index: prediction}."""
+    chunks = iter_frames(input_filename, ['index', 'image_link'], chunk_size)
+    if is_parquet(output_filename):
+        writer = None
+        for chunk in chunks:
+            indices = _in_shard(chunk, shard)['index']
+            if writer is None:
+                # The index keeps its input type, so the file compares equal to the test file
+                writer = FrameWriter(output_filename, prediction_schema(indices))
+            writer.write(pd.DataFrame({'index': indices,
+                                       'prediction': [predictions.get(str(index), '') for index in indices]}))
+        if writer is not None:
+            writer.close()
+        return
+    tmp_filename = output_filename + '.tmp'
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['index', 'prediction'])
+        for chunk in chunks:
+            for index in _in_shard(chunk, shard)['index'].astype(str):
+                writer.writerow([index, predictions.get(index, '')])
+    os.replace(tmp_filename, output_filename)
+
+def rescore(input_filename, ocr_text_filename, output_filename, ranker=None, chunk_size=1000):
+    """Predict from an OCR-text table written by an earlier run, without downloading or OCR'ing.
+
+    The first-match rule joins each chunk to the table's `text` column and
+    answers it with `batch_extract.predict_frame`; a `ranking.CandidateRanker`
+    reads the per-box columns. Images the earlier run could not OCR get an
+    empty prediction. Raises ValueError when rows have images the table does
+    not hold at all, instead of predicting them as empty.
+    """
+    if ranker is None:
+        texts = pd.Series(read_ocr_texts(ocr_text_filename), dtype=object)
+        known = texts.index
+    else:
+        results = read_ocr_results(ocr_text_filename)
+        known = pd.Index(list(results))
+    predictions = {}
+    unknown, examples = 0, []
+    with metrics.stage('rescore'):
+        for chunk in iter_frames(input_filename, ['index', 'image_link', 'entity_name'], chunk_size):
+            image_links = chunk['image_link']
+            absent = image_links[~image_links.isin(known) & image_links.map(lambda link: isinstance(link, str))]
+            unknown += len(absent)
+            examples.extend(absent.head(3 - len(examples)).tolist())
+            if ranker is None:
+                chunk_predictions = predict_frame(chunk.assign(text=image_links.map(texts).fillna('')))
+            else:
+                matches = (ranker.rank(results[image_link], entity_name) if results.get(image_link) else None
+                           for image_link, entity_name in zip(image_links, chunk['entity_name']))
+                chunk_predictions = [format_match(match) if match else None for match in matches]
+            predictions.update(zip(chunk['index'].astype(str), map(format_prediction, chunk_predictions)))
+    if unknown:
+        raise ValueError(f"{unknown} rows have images that are not in {ocr_text_filename}, e.g. {examples}. "
+                         "Re-run the prediction that wrote it, with the same output and --ocr_text_filename, "
+                         "to add them.")
+    write_output(input_filename, predictions, output_filename, chunk_size)
+
+def merge_shards(input_filename, shard_filenames, output_filename, chunk_size=1000):
+    """Combine per-shard outputs into one `index,prediction` file and sanity-check it."""
+    predictions = {}
+    for shard_filename in shard_filenames:
+        for frame in iter_frames(shard_filename, ['index', 'prediction'], chunk_size, dtype=str):
+            for index, prediction in zip(frame['index'], frame['prediction'].fillna('')):
+                if predictions.get(index, prediction) != prediction:
+                    raise ValueError(f"Index {index} has conflicting predictions across shards")
+                predictions[index] = prediction
+    write_output(input_filename, predictions, output_filename, chunk_size)
+    sanity_check(input_filename, output_filename)
+
+if __name__ == "__main__":
+    #Usage example: python predict.py --input_filename ../dataset/test.csv --output_filename ../dataset/test_out.csv
+    #Sharded: python predict.py ... --output_filename test_out_0.csv --shard 0/4, then
+    #         python predict.py ... --output_filename test_out.csv --merge_from test_out_0.csv test_out_1.csv ...
+    #Columnar: python predict.py --input_filename ../dataset/test.parquet --output_filename test_out.parquet --ocr_text_filename ocr.parquet --submission_filename test_out.csv
+    #Re-score: python predict.py --input_filename ../dataset/test.parquet --output_filename test_out.parquet --rescore_from ocr.parquet --rank_candidates
+
+    parser = argparse.ArgumentParser(description="Run batch predictions on a CSV file without the Streamlit UI.")
+    parser.add_argument("--input_filename", type=str, required=True, help="CSV or Parquet file with index, image_link and entity_name columns.")
+    parser.add_argument("--output_filename", type=str, required=True, help="The index,prediction file to write (.csv or .parquet).")
+    parser.add_argument("--checkpoint_filename", type=str, default=None, help="Checkpoint file (default: <output>.checkpoint).")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Input rows read per chunk.")
+    parser.add_argument("--flush_every", type=int, default=100, help="Rows between checkpoint flushes.")
+    parser.add_argument("--download_workers", type=int, default=16, help="Download threads.")
+    parser.add_argument("--ocr_workers", type=int, default=None, help="OCR worker processes (default: all cores).")
+    parser.add_argument("--ocr_batch_size", type=int, default=8, help="Images per batched OCR call (1 disables batching).")
+    parser.add_argument("--sequential", action="store_true", help="Call predictor row by row instead of the staged pipeline.")
+    parser.add_argument("--shard", type=str, default=None, help="Only predict shard k of N, given as k/N with 0 <= k < N.")
+    parser.add_argument("--max_side", type=int, default=None, help="Downscale images so the longer side is at most this many pixels.")
+    parser.add_argument("--grayscale", action="store_true", help="OCR grayscale images.")
+    parser.add_argument("--contrast", action="store_true", help="Apply CLAHE contrast normalization before OCR.")
+    parser.add_argument("--reduced", type=str, default="1", help="Decode at 1/2, 1/4 or 1/8 resolution (2, 4, 8 or auto).")
+    parser.add_argument("--numeric_regions", action="store_true", help="Only recognise text boxes that can hold a measurement.")
+    parser.add_argument("--image_store", type=str, default=None, help="Packed image store directory to read images from and add them to.")
+    parser.add_argument("--rank_candidates", action="store_true", help="Score every value found by OCR confidence, text height, keywords and plausibility instead of taking the first.")
+    parser.add_argument("--metrics_filename", type=str, default=None, help="Write stage timings and counters in the Prometheus text format.")
+    parser.add_argument("--ocr_text_filename", type=str, default=None, help="Keep the OCR output of the staged pipeline in this Parquet table.")
+    parser.add_argument("--rescore_from", type=str, default=None, help="Predict from an OCR-text table of an earlier run instead of running OCR.")
+    parser.add_argument("--submission_filename", type=str, default=None, help="Also export a Parquet output as this index,prediction CSV.")
+    parser.add_argument("--merge_from", type=str, nargs="+", default=None, help="Merge these shard outputs instead of predicting.")
+    args = parser.parse_args()
+
+    if args.merge_from:
+        merge_shards(args.input_filename, args.merge_from, args.output_filename, args.chunk_size)
+    elif args.rescore_from:
+        rescore(args.input_filename, args.rescore_from, args.output_filename,
+                CandidateRanker() if args.rank_candidates else None, args.chunk_size)
+        sanity_check(args.input_filename, args.output_filename)
+    else:
+        shard = parse_shard(args.shard) if args.shard else None
+        preprocessor = None
+        if args.max_side or args.grayscale or args.contrast or args.reduced != "1":
+            reduced = args.reduced if args.reduced == "auto" else int(args.reduced)
+            preprocessor = Preprocessor(args.max_side, args.grayscale, args.contrast, reduced)
+        regions = NumericRegions(unit_matcher.allowlist) if args.numeric_regions else None
+        run_batch(args.input_filename, args.output_filename, args.checkpoint_filename, args.chunk_size,
+                  args.flush_every, args.download_workers, args.ocr_workers, args.sequential, shard, preprocessor,
+                  args.ocr_batch_size, regions, ImageStore(args.image_store) if args.image_store else None,
+                  CandidateRanker() if args.rank_candidates else None, args.ocr_text_filename)
+        if args.metrics_filename:
+            with open(args.metrics_filename, 'w') as f:
+                f.write(metrics.to_prometheus())
+        if shard is None:
+            sanity_check(args.input_filename, args.output_filename)
+    if args.submission_filename and is_parquet(args.output_filename) and not args.shard:
+        export_csv(args.output_filename, args.submission_filename)
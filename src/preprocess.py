@@ -0,0 +1,88 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+REDUCED_FLAGS = {
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2, (4, False): cv2.IMREAD_REDUCED_COLOR_4, (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2, (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4, (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class Preprocessor:
+    """Configurable stage between decode and OCR that shrinks the recognizer input.
+
+    - `max_side`: downscale so the longer side is at most this many pixels.
+    - `grayscale`: decode straight to a single channel.
+    - `contrast`: apply CLAHE contrast normalization.
+    - `reduced`: decode at 1/2, 1/4 or 1/8 resolution with `cv2.IMREAD_REDUCED_*`.
+      'auto' picks the largest factor that keeps the longer side at or above
+      `max_side`, reading the size from the image header.
+
+    The default configuration reproduces the plain full-resolution RGB decode.
+    """
+
+    def __init__(self, max_side=None, grayscale=False, contrast=False, reduced=1):
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.contrast = contrast
+        self.reduced = reduced
+
+    def config(self):
+        return {'max_side': self.max_side, 'grayscale': self.grayscale, 'contrast': self.contrast,
+                'reduced': self.reduced}
+
+    def __repr__(self):
+        return 'Preprocessor({})'.format(', '.join(f'{key}={value!r}' for key, value in self.config().items()))
+
+    def _reduction(self, data):
+        if self.reduced != 'auto':
+            return self.reduced
+        if not self.max_side:
+            return 1
+        try:
+            width, height = Image.open(io.BytesIO(data)).size
+        except Exception:
+            return 1
+        for factor in (8, 4, 2):
+            if max(width, height) / factor >= self.max_side:
+                return factor
+        return 1
+
+    def decode(self, data):
+        """Decode encoded bytes, at reduced resolution when configured."""
+        buffer = np.frombuffer(data, np.uint8)
+        factor = self._reduction(data)
+        if factor in (2, 4, 8):
+            image = cv2.imdecode(buffer, REDUCED_FLAGS[(factor, self.grayscale)])
+        else:
+            image = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image data")
+        return image
+
+    def apply(self, image):
+        """Turn a decoded BGR or grayscale image into the array handed to EasyOCR."""
+        if self.max_side:
+            height, width = image.shape[:2]
+            scale = self.max_side / max(height, width)
+            if scale < 1:
+                image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        if image.ndim == 3:
+            if self.grayscale:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            else:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if self.contrast:
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            if image.ndim == 2:
+                image = clahe.apply(image)
+            else:
+                lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
+                lab[:, :, 0] = clahe.apply(lab[:, :, 0])
+                image = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+        return image
+
+    def __call__(self, data):
+        return self.apply(self.decode(data))
@@ -0,0 +1,151 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from units import unit_conversions, unit_matcher
+
+# Words that introduce an entity's value on product labels. Single letters are left out,
+# they are unit aliases too ('w' is watt).
+ENTITY_KEYWORDS = {
+    'width': ('width', 'wide', 'breadth'),
+    'depth': ('depth', 'deep', 'length', 'long'),
+    'height': ('height', 'high', 'tall'),
+    'item_weight': ('weight', 'wt', 'net', 'mass'),
+    'maximum_weight_recommendation': ('max', 'maximum', 'load', 'capacity', 'up to', 'supports'),
+    'voltage': ('voltage', 'volts', 'input', 'output', 'rated'),
+    'wattage': ('power', 'wattage', 'watts', 'output', 'rated'),
+    'item_volume': ('capacity', 'volume', 'vol', 'contents', 'net'),
+}
+
+# Values an entity can plausibly take, in the base unit of its dimension (metre, gram, volt, watt, litre)
+PLAUSIBLE_RANGES = {
+    'width': (0.002, 5.0),
+    'depth': (0.002, 5.0),
+    'height': (0.002, 5.0),
+    'item_weight': (0.1, 1e6),
+    'maximum_weight_recommendation': (100.0, 2e6),
+    'voltage': (0.5, 1000.0),
+    'wattage': (0.1, 1e5),
+    'item_volume': (0.001, 500.0),
+}
+
+DEFAULT_WEIGHTS = {'confidence': 1.0, 'height': 1.0, 'keyword': 1.0, 'plausible': 2.0, 'order': 0.25}
+
+Candidates = namedtuple('Candidates', ['text', 'matches', 'units', 'base_values', 'starts', 'confidence', 'height'])
+
+
+class CandidateRanker:
+    """Scores every `<number> <unit>` candidate of an OCR result instead of taking the first one.
+
+    `candidates(ocr_result)` runs the unit matcher once over the joined
+    `readtext` text and maps each match back to its boxes, giving NumPy
+    arrays of OCR confidence, box height relative to the tallest box,
+    position and value in the base unit. `best(candidates, entity_name)`
+    then scores the candidates with an allowed unit as a weighted sum of
+
+    - `confidence`: the OCR confidence of the match's boxes,
+    - `height`: the relative text height, as the headline spec is usually the largest,
+    - `keyword`: closeness to a word such as "weight" or "capacity" for the entity,
+    - `plausible`: 1 inside the entity's range in `PLAUSIBLE_RANGES`, decaying per
+      order of magnitude outside it,
+    - `order`: a small preference for earlier matches, so ties keep the first-match answer,
+
+    and returns the highest-scoring `UnitMatch`, or None. One OCR result is
+    scanned once however many entities are asked of it.
+    """
+
+    def __init__(self, matcher=unit_matcher, weights=None, keywords=ENTITY_KEYWORDS, ranges=PLAUSIBLE_RANGES,
+                 keyword_distance=40.0):
+        self.matcher = matcher
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.keyword_patterns = {
+            entity: re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\b', re.IGNORECASE)
+            for entity, words in keywords.items()
+        }
+        self.ranges = ranges
+        self.keyword_distance = keyword_distance
+        self.factors = {unit: factor for unit, (_, factor) in unit_conversions.items()}
+
+    def candidates(self, ocr_result):
+        """Every match in an EasyOCR `[(box, text, confidence), ...]` result, with its features."""
+        texts = [item[1] for item in ocr_result]
+        # Joined as in ImageProcessingPipeline.extract_text, so a number and unit split across boxes still match
+        text = ' '.join(texts)
+        matches = list(self.matcher.finditer(text))
+        if not matches:
+            empty = np.empty(0)
+            return Candidates(text, matches, [], empty, empty, empty, empty)
+
+        box_starts = np.cumsum([0] + [len(item) + 1 for item in texts[:-1]])
+        box_confidence = np.array([item[2] for item in ocr_result], dtype=float)
+        box_height = _box_heights([item[0] for item in ocr_result])
+        tallest = box_height.max()
+        if tallest > 0:
+            box_height /= tallest
+
+        spans = np.array([match.span for match in matches])
+        first_box = np.searchsorted(box_starts, spans[:, 0], side='right') - 1
+        last_box = np.searchsorted(box_starts, spans[:, 1] - 1, side='right') - 1
+        units = [match.unit for match in matches]
+        values = np.array([match.value for match in matches])
+        factors = np.array([self.factors.get(unit, np.nan) for unit in units])
+        return Candidates(
+            text, matches, units, values * factors, spans[:, 0],
+            np.minimum(box_confidence[first_box], box_confidence[last_box]),
+            np.maximum(box_height[first_box], box_height[last_box]),
+        )
+
+    def scores(self, candidates, entity_name):
+        """Scores of all candidates for `entity_name`; -inf where the unit is not allowed."""
+        allowed = self.matcher.entity_units.get(entity_name, frozenset())
+        count = len(candidates.matches)
+        scores = np.full(count, -np.inf)
+        positions = np.flatnonzero([unit in allowed for unit in candidates.units])
+        if not len(positions):
+            return scores
+
+        weights = self.weights
+        score = (weights['confidence'] * candidates.confidence[positions]
+                 + weights['height'] * candidates.height[positions]
+                 + weights['order'] * (1.0 - np.arange(len(positions)) / len(positions)))
+
+        pattern = self.keyword_patterns.get(entity_name)
+        if pattern is not None and weights['keyword']:
+            keyword_ends = np.array([match.end() for match in pattern.finditer(candidates.text)])
+            if len(keyword_ends):
+                distance = np.abs(candidates.starts[positions, None] - keyword_ends[None, :]).min(axis=1)
+                score += weights['keyword'] * np.exp(-distance / self.keyword_distance)
+
+        if entity_name in self.ranges and weights['plausible']:
+            low, high = self.ranges[entity_name]
+            base_values = np.maximum(candidates.base_values[positions], 1e-12)
+            magnitudes = np.maximum(np.log10(low / base_values), np.log10(base_values / high))
+            score += weights['plausible'] * np.exp(-np.maximum(magnitudes, 0.0))
+
+        scores[positions] = score
+        return scores
+
+    def best(self, candidates, entity_name):
+        """The highest-scoring allowed match for `entity_name`, or None."""
+        if not candidates.matches:
+            return None
+        scores = self.scores(candidates, entity_name)
+        position = int(np.argmax(scores))
+        return None if scores[position] == -np.inf else candidates.matches[position]
+
+    def rank(self, ocr_result, entity_name):
+        return self.best(self.candidates(ocr_result), entity_name)
+
+
+def _box_heights(boxes):
+    """Heights of EasyOCR boxes (lists of `[x, y]` corners)."""
+    try:
+        corners = np.asarray(boxes, dtype=float)
+    except (TypeError, ValueError):
+        corners = None
+    if corners is not None and corners.ndim == 3:
+        return np.ptp(corners[:, :, 1], axis=1)
+    # Boxes with different corner counts, or none at all
+    return np.array([np.ptp([point[1] for point in box]) if box is not None and len(box) else 0.0 for box in boxes],
+                    dtype=float)
@@ -1,31 +1,42 @@
-import pandas as pd
 import argparse
 import re
 import os
-import constants
-from utils import parse_string
+from units import allowed_units
+from utils import common_mistake, parse_string
+
+PREDICTION_PATTERN = r'-?\d+(\.\d+)?\s+[a-zA-Z\s]+'
 
 def check_file(filename):
-    if not filename.lower().endswith('.csv'):
-        raise ValueError("Only CSV files are allowed.")
+    if not filename.lower().endswith(('.csv', '.parquet', '.pq')):
+        raise ValueError("Only CSV and Parquet files are allowed.")
     if not os.path.exists(filename):
         raise FileNotFoundError("Filepath: {} invalid or not found.".format(filename))
 
 def sanity_check(test_filename, output_filename):
+    # pandas, NumPy and pyarrow are imported by the checks themselves, so the CLI starts without them
+    from columnar import column_names, read_frame
+
     check_file(test_filename)
     check_file(output_filename)
     
     try:
-        test_df = pd.read_csv(test_filename)
-        output_df = pd.read_csv(output_filename)
+        test_columns = column_names(test_filename)
+        output_columns = column_names(output_filename)
     except Exception as e:
         raise ValueError(f"Error reading the CSV files: {e}")
     
-    if 'index' not in test_df.columns:
+    if 'index' not in test_columns:
         raise ValueError("Test CSV file must contain the 'index' column.")
     
-    if 'index' not in output_df.columns or 'prediction' not in output_df.columns:
+    if 'index' not in output_columns or 'prediction' not in output_columns:
         raise ValueError("Output CSV file must contain 'index' and 'prediction' columns.")
+
+    # Only the columns the check needs are read
+    try:
+        test_df = read_frame(test_filename, ['index'])
+        output_df = read_frame(output_filename, ['index', 'prediction'])
+    except Exception as e:
+        raise ValueError(f"Error reading the CSV files: {e}")
     
     missing_index = set(test_df['index']).difference(set(output_df['index']))
     if len(missing_index) != 0:
@@ -38,14 +49,106 @@ def sanity_check(test_filename, output_filename):
     output_df.apply(lambda x: parse_string(x['prediction']), axis=1)
     print("Parsing successfull for file: {}".format(output_filename))
     
+def _read_index(filename, chunk_size):
+    import numpy as np
+    from columnar import iter_frames
+
+    chunks = [chunk['index'].to_numpy() for chunk in iter_frames(filename, ['index'], chunk_size)]
+    return np.concatenate(chunks) if chunks else np.array([], dtype=np.int64)
+
+def _validate_chunk(chunk, unit_cache):
+    """Return the invalid rows of an output chunk with an `error` column, matching parse_string."""
+    import pandas as pd
+
+    predictions = chunk['prediction'].astype('string').str.strip()
+    present = predictions.notna() & (predictions != '')
+    well_formed = predictions.str.fullmatch(PREDICTION_PATTERN).fillna(False).astype(bool)
+
+    units = predictions[present & well_formed].str.split(n=1).str[1]
+    for unit in units.unique():
+        if unit not in unit_cache:
+            unit_cache[unit] = common_mistake(unit) in allowed_units
+    known_unit = units.map(unit_cache).reindex(chunk.index, fill_value=True).astype(bool)
+
+    errors = pd.Series(None, index=chunk.index, dtype=object)
+    errors[present & ~well_formed] = 'invalid_format'
+    errors[present & well_formed & ~known_unit] = 'invalid_unit'
+    invalid = errors.notna()
+    return chunk.loc[invalid, ['index', 'prediction']].assign(error=errors[invalid])
+
+def streaming_sanity_check(test_filename, output_filename, chunk_size=100000, report_filename=None):
+    """Chunked sanity check that reports every invalid row instead of stopping at the first one.
+
+    Both files are read `chunk_size` rows at a time, indices are compared with
+    sorted NumPy set operations, and predictions are validated with vectorized
+    regex matching and a per-unit lookup that applies the same common_mistake
+    fixes as parse_string. Returns a summary with counts per error type.
+    """
+    import numpy as np
+    import pandas as pd
+    from columnar import column_names, iter_frames
+
+    check_file(test_filename)
+    check_file(output_filename)
+
+    try:
+        if 'index' not in column_names(test_filename):
+            raise ValueError("Test CSV file must contain the 'index' column.")
+        if not {'index', 'prediction'}.issubset(column_names(output_filename)):
+            raise ValueError("Output CSV file must contain 'index' and 'prediction' columns.")
+    except pd.errors.ParserError as e:
+        raise ValueError(f"Error reading the CSV files: {e}")
+
+    unit_cache = {}
+    invalid_rows = []
+    output_index = []
+    rows = 0
+    for chunk in iter_frames(output_filename, ['index', 'prediction'], chunk_size, dtype={'prediction': object}):
+        rows += len(chunk)
+        output_index.append(chunk['index'].to_numpy())
+        invalid = _validate_chunk(chunk, unit_cache)
+        if not invalid.empty:
+            invalid_rows.append(invalid)
+
+    test_index = np.unique(_read_index(test_filename, chunk_size))
+    output_index = np.concatenate(output_index) if output_index else np.array([], dtype=test_index.dtype)
+    missing_index = np.setdiff1d(test_index, output_index, assume_unique=True)
+    extra_index = np.setdiff1d(np.unique(output_index), test_index, assume_unique=True)
+    if len(missing_index) != 0:
+        print("Missing index in test file: {}".format(set(missing_index.tolist())))
+    if len(extra_index) != 0:
+        print("Extra index in test file: {}".format(set(extra_index.tolist())))
+
+    invalid = pd.concat(invalid_rows) if invalid_rows else pd.DataFrame(columns=['index', 'prediction', 'error'])
+    summary = {
+        'rows': rows,
+        'missing_index': len(missing_index),
+        'extra_index': len(extra_index),
+        'errors': invalid['error'].value_counts().to_dict(),
+    }
+    if not invalid.empty:
+        if report_filename:
+            invalid.to_csv(report_filename, index=False)
+            print("Invalid rows written to {}".format(report_filename))
+        else:
+            print(invalid.to_string(index=False))
+        raise ValueError("Invalid predictions in {}: {}".format(output_filename, summary['errors']))
+    print("Parsing successfull for file: {}".format(output_filename))
+    return summary
+
 if __name__ == "__main__":
     #Usage example: python sanity.py --test_filename sample_test.csv --output_filename sample_test_out.csv
     
     parser = argparse.ArgumentParser(description="Run sanity check on a CSV file.")
-    parser.add_argument("--test_filename", type=str, required=True, help="The test CSV file name.")
-    parser.add_argument("--output_filename", type=str, required=True, help="The output CSV file name to check.")
+    parser.add_argument("--test_filename", type=str, required=True, help="The test CSV or Parquet file.")
+    parser.add_argument("--output_filename", type=str, required=True, help="The output CSV or Parquet file to check.")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Stream both files in chunks of this many rows and report every invalid row.")
+    parser.add_argument("--report_filename", type=str, default=None, help="With --chunk_size, write the invalid rows to this CSV.")
     args = parser.parse_args()
     try:
-        sanity_check(args.test_filename, args.output_filename)
+        if args.chunk_size:
+            streaming_sanity_check(args.test_filename, args.output_filename, args.chunk_size, args.report_filename)
+        else:
+            sanity_check(args.test_filename, args.output_filename)
     except Exception as e:
         print('Error:', e)
\ No newline at end of file
@@ -0,0 +1,208 @@
+import re
+import sys
+from types import MappingProxyType
+from collections import namedtuple
+
+import constants
+
+# `number` is the digits as matched and is what predictions are written from; `value` is for ranking
+UnitMatch = namedtuple('UnitMatch', ['value', 'unit', 'span', 'number'])
+
+# No unit starts with a digit, dot or space, so the number never needs to backtrack.
+# Possessive quantifiers (Python 3.11+) make that explicit and keep failed lookups cheap;
+# the lookbehind stops the scan from retrying inside a number that already failed.
+if sys.version_info >= (3, 11):
+    NUMBER_PATTERN = r'(?<!\d)(\d++\.?\d*+)\s*+'
+else:
+    NUMBER_PATTERN = r'(?<!\d)(\d+\.?\d*)\s*'
+
+
+def _squash(alias):
+    return re.sub(r'\s+', '', alias.casefold())
+
+
+def _normalise(alias):
+    return ' '.join(alias.casefold().split())
+
+
+def _tokens(alias):
+    return ''.join(r'\s*' if char == ' ' else re.escape(char) for char in alias)
+
+
+def _trie_pattern(aliases, guard_aliases=()):
+    """Build a regex from a prefix trie of the aliases.
+
+    Shared prefixes are matched once, so a failed unit lookup costs one
+    character test per level instead of one per alias. Optional groups are
+    greedy, which makes the pattern prefer the longest alias.
+
+    With `guard_aliases`, an alias only matches when none of the longer guard
+    aliases it is a prefix of would match at the same place.
+    """
+    trie = {}
+    for alias in aliases:
+        node = trie
+        for char in _normalise(alias):
+            node = node.setdefault(char, {})
+        node[''] = {}
+    guards = [_normalise(alias) for alias in guard_aliases]
+
+    def build(node, prefix):
+        branches = [_tokens(char) + build(node[char], prefix + char) for char in sorted(char for char in node if char)]
+        body = ''
+        if branches:
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' not in node:
+            return body
+        continuations = sorted({guard[len(prefix):] for guard in guards
+                                if len(guard) > len(prefix) and guard.startswith(prefix)})
+        end = '(?!' + '|'.join(_tokens(continuation) for continuation in continuations) + ')' if continuations else ''
+        if not body:
+            return end
+        return '(?:' + body + ')?' if not end else '(?:' + body + '|' + end + ')'
+
+    return build(trie, '')
+
+
+class UnitMatcher:
+    """Single-pass extractor of `<number> <unit>` pairs, compiled once from an alias table.
+
+    The unit alternation is generated from a prefix trie and prefers the
+    longest alias, and multi-word aliases accept any run of whitespace (or
+    none) between words. Matches come back as typed
+    `UnitMatch(value, canonical_unit, span, number)` tuples.
+
+    `entity_patterns` holds one pattern per entity that only matches where
+    the longest alias has an allowed unit, so the answer for an entity is a
+    single regex search.
+    """
+
+    def __init__(self, unit_mapping, entity_unit_map):
+        self.canonical = {_squash(alias): unit for alias, unit in unit_mapping.items()}
+        self.canonical.update((alias.casefold(), unit) for alias, unit in unit_mapping.items())
+        self.entity_units = {entity: frozenset(units) for entity, units in entity_unit_map.items()}
+        self.pattern = re.compile(NUMBER_PATTERN + '(' + _trie_pattern(unit_mapping) + ')', re.IGNORECASE)
+        # Per entity, a pattern whose first match is the first match of `pattern` with an allowed unit
+        self.entity_patterns = {
+            entity: re.compile(NUMBER_PATTERN + '(' + _trie_pattern(
+                [alias for alias, unit in unit_mapping.items() if unit in units], unit_mapping) + ')', re.IGNORECASE)
+            for entity, units in self.entity_units.items()
+        }
+
+    @property
+    def allowlist(self):
+        """Every character a `<number> <unit>` match can contain, for a restricted OCR recogniser."""
+        letters = {char for alias in self.canonical for char in alias if not char.isspace()}
+        letters |= {char.upper() for char in letters}
+        return ''.join(sorted(letters | set('0123456789., ')))
+
+    def _unit(self, alias):
+        return self.canonical.get(alias.casefold()) or self.canonical[_squash(alias)]
+
+    def finditer(self, text):
+        for match in self.pattern.finditer(text):
+            yield self._match(match)
+
+    def findall(self, text):
+        return list(self.finditer(text))
+
+    def for_entity(self, text, entity_name):
+        """Return the matches whose unit is allowed for `entity_name`."""
+        allowed = self.entity_units.get(entity_name)
+        if not allowed:
+            return []
+        return [match for match in self.finditer(text) if match.unit in allowed]
+
+    def first_for_entity(self, text, entity_name):
+        """Return the first allowed match, stopping the scan as soon as it is found."""
+        pattern = self.entity_patterns.get(entity_name)
+        if pattern is None:
+            return None
+        match = pattern.search(text)
+        if match is None:
+            return None
+        return self._match(match)
+
+    def _match(self, match):
+        number = match.group(1)
+        return UnitMatch(float(number), self._unit(match.group(2)), match.span(), number)
+
+
+def format_number(number):
+    """The matched digits without a trailing '.', e.g. '5.' -> '5'."""
+    return number[:-1] if number.endswith('.') else number
+
+
+def format_match(match):
+    # From the matched digits, as repr(float) would write small and large values with an exponent
+    return f"{format_number(match.number)} {match.unit}"
+
+
+# Every spelling OCR text may use for a unit, mapped to its canonical name in constants.allowed_units
+unit_mapping = MappingProxyType({
+    'cm': 'centimetre', 'centimetre': 'centimetre', 'centimeter': 'centimetre', 'centimeters': 'centimetre',
+    'foot': 'foot', 'feet': 'foot', 'ft': 'foot',
+    'inch': 'inch', 'inches': 'inch', 'in': 'inch',
+    'metre': 'metre', 'meter': 'metre', 'meters': 'metre', 'm': 'metre',
+    'millimetre': 'millimetre', 'millimeter': 'millimetre', 'millimeters': 'millimetre', 'mm': 'millimetre',
+    'yard': 'yard', 'yards': 'yard', 'yd': 'yard',
+    'gram': 'gram', 'g': 'gram', 'gm': 'gram', 'grams': 'gram', 'gramme': 'gram', 'gms': 'gram',
+    'kilogram': 'kilogram', 'kg': 'kilogram', 'kgs': 'kilogram', 'kilo': 'kilogram', 'kilos': 'kilogram', 'kilograms': 'kilogram',
+    'microgram': 'microgram', 'µg': 'microgram', 'micrograms': 'microgram',
+    'milligram': 'milligram', 'mg': 'milligram', 'milligrams': 'milligram',
+    'ounce': 'ounce', 'oz': 'ounce', 'ounces': 'ounce',
+    'pound': 'pound', 'lb': 'pound', 'lbs': 'pound', 'pounds': 'pound',
+    'ton': 'ton', 'tons': 'ton', 'tonne': 'ton', 'tonnes': 'ton', 't': 'ton',
+    'kilovolt': 'kilovolt', 'kv': 'kilovolt', 'kilovolts': 'kilovolt',
+    'millivolt': 'millivolt', 'mv': 'millivolt', 'millivolts': 'millivolt',
+    'volt': 'volt', 'v': 'volt', 'volts': 'volt',
+    'watt': 'watt', 'w': 'watt', 'watts': 'watt',
+    'kilowatt': 'kilowatt', 'kw': 'kilowatt', 'kilowatts': 'kilowatt',
+    'centilitre': 'centilitre', 'cl': 'centilitre', 'centilitres': 'centilitre',
+    'cubic foot': 'cubic foot', 'ft³': 'cubic foot', 'cubic feet': 'cubic foot',
+    'cubic inch': 'cubic inch', 'in³': 'cubic inch', 'cubic inches': 'cubic inch',
+    'cup': 'cup', 'c': 'cup', 'cups': 'cup',
+    'decilitre': 'decilitre', 'dl': 'decilitre', 'decilitres': 'decilitre',
+    'fluid ounce': 'fluid ounce', 'fl oz': 'fluid ounce', 'fluid ounces': 'fluid ounce',
+    'gallon': 'gallon', 'gal': 'gallon', 'gallons': 'gallon',
+    'imperial gallon': 'imperial gallon', 'imp gal': 'imperial gallon', 'imperial gallons': 'imperial gallon',
+    'litre': 'litre', 'l': 'litre', 'litres': 'litre', 'liter': 'litre', 'liters': 'litre',
+    'microlitre': 'microlitre', 'µl': 'microlitre', 'microlitres': 'microlitre',
+    'millilitre': 'millilitre', 'ml': 'millilitre', 'millilitres': 'millilitre',
+    'pint': 'pint', 'pt': 'pint', 'pints': 'pint',
+    'quart': 'quart', 'qt': 'quart', 'quarts': 'quart'
+})
+
+# The allowed units of each entity, from the challenge's constants
+entity_unit_map = MappingProxyType({entity: frozenset(units) for entity, units in constants.entity_unit_map.items()})
+allowed_units = frozenset(constants.allowed_units)
+
+# Canonical unit -> (base unit of its dimension, factor to convert a value to that base unit)
+unit_conversions = MappingProxyType({
+    'millimetre': ('metre', 0.001), 'centimetre': ('metre', 0.01), 'metre': ('metre', 1.0),
+    'inch': ('metre', 0.0254), 'foot': ('metre', 0.3048), 'yard': ('metre', 0.9144),
+    'microgram': ('gram', 1e-6), 'milligram': ('gram', 0.001), 'gram': ('gram', 1.0),
+    'kilogram': ('gram', 1000.0), 'ounce': ('gram', 28.349523125), 'pound': ('gram', 453.59237),
+    'ton': ('gram', 1e6),
+    'millivolt': ('volt', 0.001), 'volt': ('volt', 1.0), 'kilovolt': ('volt', 1000.0),
+    'watt': ('watt', 1.0), 'kilowatt': ('watt', 1000.0),
+    'microlitre': ('litre', 1e-6), 'millilitre': ('litre', 0.001), 'centilitre': ('litre', 0.01),
+    'decilitre': ('litre', 0.1), 'litre': ('litre', 1.0), 'fluid ounce': ('litre', 0.0295735295625),
+    'cup': ('litre', 0.2365882365), 'pint': ('litre', 0.473176473), 'quart': ('litre', 0.946352946),
+    'gallon': ('litre', 3.785411784), 'imperial gallon': ('litre', 4.54609),
+    'cubic inch': ('litre', 0.016387064), 'cubic foot': ('litre', 28.316846592),
+})
+
+_unknown = (set(unit_mapping.values()) | set(unit_conversions)) - allowed_units
+if _unknown:
+    raise ValueError(f"Units not in constants.allowed_units: {sorted(_unknown)}")
+
+
+def to_base(value, unit):
+    """Convert a value in a canonical unit to `(value, base_unit)` of its dimension."""
+    base_unit, factor = unit_conversions[unit]
+    return value * factor, base_unit
+
+
+# Compiled once at import and shared by the pages, predict.py and the benchmarks
+unit_matcher = UnitMatcher(unit_mapping, entity_unit_map)
@@ -1,25 +1,19 @@
 import re
-import constants
 import os
-import requests
-import pandas as pd
 import multiprocessing
 import time
-from time import time as timer
-from tqdm import tqdm
-import numpy as np
 from pathlib import Path
 from functools import partial
-import requests
-import urllib
-from PIL import Image
+
+from metrics import metrics
+from units import allowed_units
 
 def common_mistake(unit):
-    if unit in constants.allowed_units:
+    if unit in allowed_units:
         return unit
-    if unit.replace('ter', 'tre') in constants.allowed_units:
+    if unit.replace('ter', 'tre') in allowed_units:
         return unit.replace('ter', 'tre')
-    if unit.replace('feet', 'foot') in constants.allowed_units:
+    if unit.replace('feet', 'foot') in allowed_units:
         return unit.replace('feet', 'foot')
     return unit
 
@@ -33,13 +27,16 @@ def parse_string(s):
     parts = s_stripped.split(maxsplit=1)
     number = float(parts[0])
     unit = common_mistake(parts[1])
-    if unit not in constants.allowed_units:
+    if unit not in allowed_units:
         raise ValueError("Invalid unit [{}] found in {}. Allowed units: {}".format(
-            unit, s, constants.allowed_units))
+            unit, s, allowed_units))
     return number, unit
 
 
 def create_placeholder_image(image_save_path):
+    # The download helpers import what they need, so importing parse_string stays light
+    from PIL import Image
+
     try:
         placeholder_image = Image.new('RGB', (100, 100), color='black')
         placeholder_image.save(image_save_path)
@@ -47,37 +44,86 @@ def create_placeholder_image(image_save_path):
         return
 
 def download_image(image_link, save_folder, retries=3, delay=3):
+    import urllib.request
+
     if not isinstance(image_link, str):
+        metrics.increment('missing_invalid')
         return
 
     filename = Path(image_link).name
     image_save_path = os.path.join(save_folder, filename)
 
     if os.path.exists(image_save_path):
+        metrics.increment('download_exists')
         return
 
-    for _ in range(retries):
-        try:
-            urllib.request.urlretrieve(image_link, image_save_path)
-            return
-        except:
-            time.sleep(delay)
-    
-    create_placeholder_image(image_save_path) #Create a black placeholder image for invalid links/images
+    with metrics.stage('download_image'):
+        for attempt in range(retries):
+            if attempt:
+                metrics.increment('retries')
+            try:
+                urllib.request.urlretrieve(image_link, image_save_path)
+                return
+            except Exception as e:
+                metrics.record_error('download_image', e)
+                time.sleep(delay)
+
+        metrics.increment('placeholders')
+        create_placeholder_image(image_save_path) #Create a black placeholder image for invalid links/images
+
+def _download_image_and_drain(image_link, save_folder, retries=3, delay=3):
+    # Runs in a pool process; the parent merges what this download recorded
+    download_image(image_link, save_folder, retries, delay)
+    return metrics.drain()
+
+def download_images(image_links, download_folder, allow_multiprocessing=True, use_async=False, concurrency=64,
+                    packed=False):
+    from tqdm import tqdm
 
-def download_images(image_links, download_folder, allow_multiprocessing=True):
     if not os.path.exists(download_folder):
         os.makedirs(download_folder)
 
+    if packed:
+        # One data file plus an index in download_folder instead of one file per image; returns the failed links
+        from image_store import ImageStore
+        return ImageStore(download_folder).download(image_links, workers=concurrency)
+
+    if use_async:
+        # One process, pooled keep-alive connections; failures are reported instead of replaced by placeholders
+        from downloader import AsyncDownloader
+        return AsyncDownloader(concurrency=concurrency).download(image_links, download_folder)
+
     if allow_multiprocessing:
         download_image_partial = partial(
-            download_image, save_folder=download_folder, retries=3, delay=3)
+            _download_image_and_drain, save_folder=download_folder, retries=3, delay=3)
 
         with multiprocessing.Pool(64) as pool:
-            list(tqdm(pool.imap(download_image_partial, image_links), total=len(image_links)))
+            for snapshot in tqdm(pool.imap(download_image_partial, image_links), total=len(image_links)):
+                metrics.merge(snapshot)
             pool.close()
             pool.join()
     else:
         for image_link in tqdm(image_links, total=len(image_links)):
             download_image(image_link, save_folder=download_folder, retries=3, delay=3)
-        
\ No newline at end of file
+        
+
+def ocr_downloaded_images(image_links, download_folder, cache=None):
+    """OCR the files `download_images` wrote for `image_links`, through the on-disk OCR cache.
+
+    Returns {image_link: readtext result}. Images OCR'd before, by this or
+    any other workflow sharing the cache, are not OCR'd again; links without
+    a file are left out.
+    """
+    from tqdm import tqdm
+    from ocr import get_reader_service
+    from ocr_cache import get_ocr_cache
+
+    cache = cache or get_ocr_cache()
+    service = get_reader_service()
+    results = {}
+    for image_link in tqdm(dict.fromkeys(link for link in image_links if isinstance(link, str))):
+        image_path = os.path.join(download_folder, Path(image_link).name)
+        if os.path.exists(image_path):
+            with metrics.stage('ocr'):
+                results[image_link] = cache.readtext_file(image_path, service)
+    return results
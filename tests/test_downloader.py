@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from downloader import AsyncDownloader
+
+pytest.importorskip('aiohttp')
+
+BODY = b'\xff\xd8' + bytes(range(256)) * 64
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves BODY for /ok_*, 404 for /missing_*, and a 503 before the first success of /flaky_*."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+            hits = self.server.hits[self.path]
+        if self.path.startswith('/missing') or (self.path.startswith('/flaky') and hits == 1):
+            self.send_response(404 if self.path.startswith('/missing') else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    httpd.hits = {}
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(links, folder):
+    return AsyncDownloader(concurrency=8, retries=3, backoff=0.01, timeout=10).download(links, folder, progress=False)
+
+
+def test_success(server, tmp_path):
+    _, base = server
+    [result] = download([f"{base}/ok_1.jpg"], tmp_path)
+    assert result.status == 'ok'
+    assert result.bytes == len(BODY)
+    assert (tmp_path / 'ok_1.jpg').read_bytes() == BODY
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.part')]
+
+
+def test_client_error_is_not_retried(server, tmp_path):
+    httpd, base = server
+    [result] = download([f"{base}/missing_1.jpg"], tmp_path)
+    assert result.status == 'failed'
+    assert result.error == 'HTTP 404'
+    assert result.attempts == 1
+    assert httpd.hits['/missing_1.jpg'] == 1
+    assert not os.listdir(tmp_path)
+
+
+def test_server_error_is_retried(server, tmp_path):
+    httpd, base = server
+    [result] = download([f"{base}/flaky_1.jpg"], tmp_path)
+    assert result.status == 'ok'
+    assert result.attempts == 2
+    assert httpd.hits['/flaky_1.jpg'] == 2
+
+
+def test_duplicate_links_are_fetched_once(server, tmp_path):
+    httpd, base = server
+    links = [f"{base}/ok_2.jpg"] * 5 + [f"{base}/ok_3.jpg", float('nan'), f"{base}/ok_2.jpg"]
+    results = download(links, tmp_path)
+    assert [result.url for result in results if isinstance(result.url, str)] == [link for link in links if isinstance(link, str)]
+    assert [result.status for result in results] == ['ok'] * 6 + ['invalid', 'ok']
+    assert httpd.hits == {'/ok_2.jpg': 1, '/ok_3.jpg': 1}
+    assert sorted(os.listdir(tmp_path)) == ['ok_2.jpg', 'ok_3.jpg']
+
+
+def test_existing_file_is_not_downloaded(server, tmp_path):
+    httpd, base = server
+    (tmp_path / 'ok_4.jpg').write_bytes(b'already here')
+    [result] = download([f"{base}/ok_4.jpg"], tmp_path)
+    assert result.status == 'exists'
+    assert httpd.hits == {}
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from pipeline import MissingImage, fetch_image
+
+BODY = b'\xff\xd8' + bytes(range(256)) * 2000
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves BODY, cut off halfway on every hit of /short_* and /chunked_*, and on the first hit of /*_once."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+            hits = self.server.hits[self.path]
+        truncate = self.path.startswith(('/short', '/chunked')) and (hits == 1 or not self.path.endswith('_once'))
+        body = BODY[:len(BODY) // 2] if truncate else BODY
+        self.send_response(200)
+        if self.path.startswith('/chunked'):
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'%x\r\n' % len(body) + body + b'\r\n')
+            if not truncate:
+                self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(body)
+        self.close_connection = truncate
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    httpd.hits = {}
+    httpd.lock = threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_success(server):
+    _, base = server
+    assert bytes(fetch_image(f"{base}/ok.jpg")) == BODY
+
+
+@pytest.mark.parametrize('path', ['/short.jpg', '/chunked.jpg'])
+def test_truncated_body_is_missing(server, path):
+    httpd, base = server
+    result = fetch_image(base + path, retries=2, backoff=0.01)
+    assert isinstance(result, MissingImage)
+    assert result.status == 'failed'
+    assert httpd.hits[path] == 2
+
+
+@pytest.mark.parametrize('path', ['/short_once', '/chunked_once'])
+def test_truncated_body_is_retried(server, path):
+    httpd, base = server
+    assert bytes(fetch_image(base + path, backoff=0.01)) == BODY
+    assert httpd.hits[path] == 2